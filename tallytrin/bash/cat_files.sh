@@ -1,14 +1,21 @@
 #!/bin/bash
 
+# Use parallel gzip for the output side when pigz is available
+if command -v pigz > /dev/null 2>&1; then
+    GZIP_CMD="pigz -p 4"
+else
+    GZIP_CMD="gzip"
+fi
+
 # Define base string
-base_command="cat seperate_samples.dir/*SampleNUM.fastq | gzip > UCL-MM-Samples1-12_SampleNUM.fastq.gz"
+base_command="cat seperate_samples.dir/*SampleNUM.fastq | $GZIP_CMD > UCL-MM-Samples1-12_SampleNUM.fastq.gz"
 
 # Loop over 12 samples
 for i in $(seq 1 12)
 do
     # Replace 'NUM' with the current sample number
     command=${base_command//NUM/$i}
-    
+
     # Execute the command
     echo "Running: $command"
     eval $command
@@ -94,6 +94,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 # Determine the location of the input fastq files
 
 try:
@@ -109,12 +116,24 @@ else:
         DATADIR = PARAMS['data']
 
 
+_DBH = None
+
+
 def connect():
-    ''' Connect to database'''
+    ''' Connect to the database, reusing a single cached connection.
+
+    WAL journaling lets readers and the writer proceed concurrently and
+    avoids the per-call fsync of the default rollback journal.'''
 
-    dbh = sqlite3.connect('csvdb')
+    global _DBH
 
-    return dbh
+    if _DBH is None:
+        _DBH = sqlite3.connect('csvdb', check_same_thread=False)
+        _DBH.execute("PRAGMA journal_mode=WAL")
+        _DBH.execute("PRAGMA synchronous=NORMAL")
+        _DBH.execute("PRAGMA cache_size=-65536")
+
+    return _DBH
 
 
 SEQUENCESUFFIXES = ("*.fastq")
@@ -122,27 +141,43 @@ SEQUENCEFILES = tuple([os.path.join(DATADIR, suffix_name)
                        for suffix_name in SEQUENCESUFFIXES])
 
 
+@files(PARAMS['minimap2_fasta_cdna'],
+       PARAMS['minimap2_fasta_cdna'] + ".mmi")
+def build_mm2_index(infile, outfile):
+    '''
+    Builds the minimap2 index for the transcriptome once, so the
+    per-chunk mapping jobs reuse the .mmi instead of each re-indexing
+    the cDNA FASTA.
+    '''
+
+    options = PARAMS['minimap2_options']
+
+    statement = '''minimap2 %(options)s -d %(outfile)s %(infile)s'''
+
+    P.run(statement, job_threads=PARAMS['default_threads'])
+
+
 @follows(mkdir("split_tmp.dir"))
-@split('%s/*.fastq.gz'% (PARAMS['data']), "split_tmp.dir/out*")
+@split('%s/*.fastq.gz'% (PARAMS['data']), "split_tmp.dir/*.part_*.fastq.gz")
 def split_fastq(infile, outfiles):
     '''
-    Splits the input fastq file into smaller chunks. 
-    The number of lines per chunk is determined by the split 
-    parameter from the config file. The output files are 
-    stored in the "split_tmp.dir" directory.
+    Splits the input fastq file into smaller chunks using seqkit split2,
+    which chunks records natively and reads the gzipped input with
+    threaded decompression. The number of chunks is set by the nchunks
+    parameter in the config file. The output files are stored in the
+    "split_tmp.dir" directory.
     '''
 
     infile = "".join(infile)
 
-    statement = '''zcat %(infile)s | split -l %(split)s - out. &&
-                   mv out*.* split_tmp.dir/'''
+    statement = '''seqkit split2 -j %(job_threads)s -p %(nchunks)s -O split_tmp.dir/ %(infile)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @follows(mkdir("polyA_correct.dir"))
 @transform(split_fastq,
-           regex("split_tmp.dir/out.(\S+)"),
+           regex(r"split_tmp.dir/(\S+)\.fastq\.gz"),
            r"polyA_correct.dir/\1_correct_polya.fastq")
 def correct_polyA(infile, outfile):
     '''
@@ -151,8 +186,6 @@ def correct_polyA(infile, outfile):
     the "polyA_correct.dir" directory.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/complement_polyA_singlecell.py --infile=%(infile)s --outname=%(outfile)s && truncate -s 0 %(infile)s'''
 
     P.run(statement, job_options='-t 24:00:00')
@@ -160,7 +193,7 @@ def correct_polyA(infile, outfile):
 
 @follows(mkdir("polyA_umi.dir"))
 @transform(correct_polyA,
-           regex("polyA_correct.dir/(\S+)_correct_polya.fastq"),
+           regex(r"polyA_correct.dir/(\S+)_correct_polya.fastq"),
            r"polyA_umi.dir/\1.fastq.gz")
 def identify_bcumi(infile, outfile):
     '''
@@ -174,12 +207,10 @@ def identify_bcumi(infile, outfile):
 
     cmimode = PARAMS['cmi_mode']
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/10x_identify_barcode.py --outfile=%(outfile)s --infile=%(infile)s --whitelist=polyA_umi.dir/%(name)s.whitelist.txt
-                   --cmimode=%(cmimode)s --barcode=%(barcode)s  --umi=%(umi_length)s && truncate -s 0  %(infile)s'''
+                   --cmimode=%(cmimode)s --barcode=%(barcode)s  --umi=%(umi_length)s --processes=%(job_threads)s && truncate -s 0  %(infile)s'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=PARAMS['default_threads'], job_options='-t 24:00:00')
 
 
 
@@ -199,7 +230,10 @@ def merge_whitelist(infiles, outfile):
 
     whitelist_files = " ".join(whitelists)
 
-    statement = '''cat %(whitelist_files)s  > %(outfile)s'''
+    # keep duplicates: correct_10xbarcode.py ranks barcodes with
+    # Counter.most_common, so how many chunks saw a barcode is the
+    # signal that separates real cells from error barcodes
+    statement = '''cat %(whitelist_files)s > %(outfile)s'''
 
     P.run(statement)
 
@@ -208,7 +242,7 @@ def merge_whitelist(infiles, outfile):
 @follows(merge_whitelist)
 @follows(mkdir("correct_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            r"correct_reads.dir/\1.fastq.gz")
 def correct_reads(infile, outfile):
     '''
@@ -220,8 +254,6 @@ def correct_reads(infile, outfile):
     infile = infile
     cells = PARAMS['cells']
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     cmimode = PARAMS['cmi_mode']
 
 
@@ -248,45 +280,49 @@ def merge_correct_reads(infiles, outfile):
 
 
 
-    statement = '''cat %(infile_join)s > %(outfile)s'''
+    statement = '''pigz -cd -p 4 %(infile_join)s | pigz -p %(job_threads)s -c > %(outfile)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
-@transform(merge_correct_reads,
-           regex("merge_corrected.fastq.gz"),
-           r"final.sam")
-def mapping(infile, outfile):
+@follows(build_mm2_index)
+@follows(mkdir("mapped_chunks.dir"))
+@transform(correct_reads,
+           regex(r"correct_reads.dir/(\S+).fastq.gz"),
+           r"mapped_chunks.dir/\1.bam")
+def mapping_chunk(infile, outfile):
     '''
-    Maps the input fastq file to the reference transcriptome
-    using minimap2. The output is a SAM file called "final.sam".
+    Maps each corrected fastq chunk to the reference transcriptome
+    using minimap2 and sorts the alignments, so the chunks map in
+    parallel across the cluster instead of as one monolithic job.
     '''
 
-
-    cdna = PARAMS['minimap2_fasta_cdna']
+    mmi = PARAMS['minimap2_fasta_cdna'] + ".mmi"
     options = PARAMS['minimap2_options']
     run_options = PARAMS['job_options']
 
-    statement = '''minimap2  %(options)s %(cdna)s  %(infile)s > %(outfile)s 2> %(outfile)s.log'''
+    statement = '''minimap2 -t %(job_threads)s %(options)s %(mmi)s %(infile)s 2> %(outfile)s.log |
+                   samtools sort -@ %(job_threads)s -o %(outfile)s -'''
 
-    P.run(statement, job_options=run_options, job_threads=4)
+    P.run(statement, job_options=run_options, job_threads=PARAMS['default_threads'])
 
 
-@transform(mapping,
-           regex("final.sam"),
-           r"final_sorted.bam")
-def run_samtools(infile, outfile):
-    '''Converts the input SAM file to a BAM file, sorts it, and indexes it.
-    The output is a sorted BAM file called "final_sorted.bam".'''
+@merge(mapping_chunk, "final_sorted.bam")
+def mapping(infiles, outfile):
+    '''
+    Merges the per-chunk sorted BAM files into "final_sorted.bam"
+    and indexes it.
+    '''
 
-    statement = '''samtools view -bS %(infile)s > final.bam &&
-                   samtools sort final.bam -o final_sorted.bam &&
-                   samtools index final_sorted.bam'''
+    infile_join = " ".join(infiles)
 
-    P.run(statement, job_options='-t 24:00:00')
+    statement = '''samtools merge -f -@ %(job_threads)s %(outfile)s %(infile_join)s &&
+                   samtools index -@ %(job_threads)s %(outfile)s'''
+
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
-@transform(run_samtools,
+@transform(mapping,
            regex("final_sorted.bam"),
            r"final_XT.bam")
 def add_xt_tag(infile, outfile):
@@ -294,10 +330,7 @@ def add_xt_tag(infile, outfile):
     file so that umi-tools can perform read counting. The output
     is a BAM file called "final_XT.bam".'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement, job_options='-t 24:00:00')
 
@@ -324,7 +357,6 @@ def convert_tomtx(infile, outfile):
     Converts the count matrix in the input TSV file to a .mtx format.
     The output is stored in the "mtx.dir" directory.
     '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
     filter = PARAMS['mtx_mincounts']
 
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx.dir/ --filter=%(filter)s'''
@@ -363,7 +395,7 @@ def minimap2_genome(infile, outfile):
 
 @follows(mkdir("qc_reports.dir/fastqc_reports"))
 @transform(minimap2_genome,
-           regex("mapped_genome\.dir/(.*)\.sam"),
+           regex(r"mapped_genome\.dir/(.*)\.sam"),
            r"qc_reports.dir/fastqc_reports/\1_fastqc.html")
 def mapped_genome_fastqc(infile, outfile):
     """
@@ -378,7 +410,7 @@ def mapped_genome_fastqc(infile, outfile):
 
 
 @transform(minimap2_genome,
-           regex("mapped_genome\.dir/(.*)\.sam"),
+           regex(r"mapped_genome\.dir/(.*)\.sam"),
            r"mapped_genome.dir/\1_sorted.bam")
 def gene_samtools(infile, outfile):
     """
@@ -386,11 +418,13 @@ def gene_samtools(infile, outfile):
     then sorts and indexes these.
     """
 
-    statement = f"""samtools view -b {infile} |
-                    samtools sort - -o {outfile} &&
-                    samtools index {outfile}"""
+    threads = PARAMS['default_threads']
 
-    P.run(statement)
+    statement = f"""samtools view -b -@ {threads} {infile} |
+                    samtools sort -@ {threads} - -o {outfile} &&
+                    samtools index -@ {threads} {outfile}"""
+
+    P.run(statement, job_threads=threads)
 
 
 @transform(gene_samtools,
@@ -405,10 +439,10 @@ def gene_add_XT(infile, outfile):
     geneset = PARAMS['featurecounts_gtf']
     feature_threads = PARAMS['featurecounts_threads']
     
-    statement = """samtools view -h %(infile)s | awk -v OFS="\\t" '{if($0 ~ /^@/){print $0} else {print $1, $2, $3, $4, $5, $6, $7, $8, $9, "*", "*"}}' | samtools view -bS > mapped_genome.dir/stripped.bam  &&
+    statement = """samtools view -h %(infile)s | awk -v OFS="\\t" '{if($0 ~ /^@/){print $0} else {print $1, $2, $3, $4, $5, $6, $7, $8, $9, "*", "*"}}' | samtools view -b -@ %(job_threads)s --no-PG -o mapped_genome.dir/stripped.bam  &&
 featureCounts -a %(geneset)s -o mapped_genome.dir/gene_assigned -R BAM mapped_genome.dir/stripped.bam -T %(feature_threads)s --maxMOp 200"""
 
-    P.run(statement)
+    P.run(statement, job_threads=4)
 
 
 @transform(gene_add_XT,
@@ -418,10 +452,10 @@ def sort_index_gene(infile, outfile):
     '''
     '''
 
-    statement = '''samtools sort %(infile)s -o %(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''samtools sort -@ %(job_threads)s %(infile)s -o %(outfile)s &&
+                   samtools index -@ %(job_threads)s %(outfile)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @follows(mkdir("gene_counts.dir/umi_tools"))
@@ -445,7 +479,7 @@ def gene_count_umi(infile, outfile):
 
 
 @transform(gene_count_umi,
-           regex("gene_counts\.dir/umi_tools/stripped.tsv"),
+           regex(r"gene_counts\.dir/umi_tools/stripped.tsv"),
            r"gene_counts.dir/umi_tools/stripped/genes.mtx")
 def gene_save_umitools_mtx(infile, outfile):
     """
@@ -457,7 +491,6 @@ def gene_save_umitools_mtx(infile, outfile):
     """
 
     filter = PARAMS["mtx_filter"]
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
     outdir = os.path.dirname(outfile)
 
     statement = f"""python {PYTHON_ROOT}/save_mtx.py
@@ -465,7 +498,7 @@ def gene_save_umitools_mtx(infile, outfile):
                     --dir {outdir}
                     --filter {filter}"""
 
-    P.run(statement, job_memory='100G')
+    P.run(statement, job_memory='16G')
 
 
 @follows(mkdir("qc_reports.dir"), mapped_genome_fastqc)
@@ -82,6 +82,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 # Determine the location of the input fastq files
 
 try:
@@ -97,12 +104,24 @@ else:
         DATADIR = PARAMS['data']
 
 
+_DBH = None
+
+
 def connect():
-    ''' Connect to database'''
+    ''' Connect to the database, reusing a single cached connection.
 
-    dbh = sqlite3.connect('csvdb')
+    WAL journaling lets readers and the writer proceed concurrently and
+    avoids the per-call fsync of the default rollback journal.'''
 
-    return dbh
+    global _DBH
+
+    if _DBH is None:
+        _DBH = sqlite3.connect('csvdb', check_same_thread=False)
+        _DBH.execute("PRAGMA journal_mode=WAL")
+        _DBH.execute("PRAGMA synchronous=NORMAL")
+        _DBH.execute("PRAGMA cache_size=-65536")
+
+    return _DBH
 
 
 SEQUENCESUFFIXES = ("*.fastq.1.gz")
@@ -111,7 +130,7 @@ SEQUENCEFILES = tuple([os.path.join(DATADIR, suffix_name)
 
 
 @transform(SEQUENCEFILES,
-           regex("data.dir/(\S+).fastq.1.gz"),
+           regex(r"data.dir/(\S+).fastq.1.gz"),
            r"\1.whitelist.txt")
 def identify_barcode(infile, outfile):
     '''
@@ -130,7 +149,7 @@ def identify_barcode(infile, outfile):
 
 @follows(mkdir('extracted_fastq.dir'))
 @transform(SEQUENCEFILES,
-           regex('data.dir/(\S+).fastq.1.gz'),
+           regex(r'data.dir/(\S+).fastq.1.gz'),
            add_inputs(identify_barcode),
            r'extracted_fastq.dir/\1_extracted.fastq.1.gz')
 def extract_bcumi(infiles, outfile):
@@ -152,7 +171,7 @@ def extract_bcumi(infiles, outfile):
 
 @follows(mkdir("hisat_mapping.dir"))
 @transform(extract_bcumi,
-           regex('extracted_fastq.dir/(\S+)_extracted.fastq.1.gz'),
+           regex(r'extracted_fastq.dir/(\S+)_extracted.fastq.1.gz'),
            r'hisat_mapping.dir/\1.bam')
 def hisat2_map(infile, outfile):
     '''
@@ -165,7 +184,7 @@ def hisat2_map(infile, outfile):
     index_prefix = PARAMS['hisat2_index_dir'] + '/' + PARAMS['hisat2_index_name']
 
     statement = '''ln -s %(read2)s tmp.fastq.gz && hisat2 %(hisat2_options)s -x %(index_prefix)s --threads %(job_threads)i
-                   -U tmp.fastq.gz 2> %(outfile)s.log | samtools view -bS > %(outfile)s.tmp
+                   -U tmp.fastq.gz 2> %(outfile)s.log | samtools view -b -@ %(job_threads)s --no-PG -o %(outfile)s.tmp
                    2>> %(outfile)s.log && samtools sort -o %(outfile)s %(outfile)s.tmp &&
                    rm -rf %(outfile)s.tmp'''
 
@@ -174,7 +193,7 @@ def hisat2_map(infile, outfile):
 
 
 @transform(hisat2_map,
-           regex('hisat_mapping.dir/(\S+).bam'),
+           regex(r'hisat_mapping.dir/(\S+).bam'),
            r'\1.bam.featureCounts.bam')
 def featurecounts(infile, outfile):
     '''
@@ -190,7 +209,7 @@ def featurecounts(infile, outfile):
 
 
 @transform(featurecounts,
-           regex('(\S+).featureCounts.bam'),
+           regex(r'(\S+).featureCounts.bam'),
            r'\1_sorted.bam')
 def sort_index(infile, outfile):
     '''
@@ -203,7 +222,7 @@ def sort_index(infile, outfile):
 
 
 @transform(sort_index,
-           regex("(\S+).bam_sorted.bam"),
+           regex(r"(\S+).bam_sorted.bam"),
            r"counts.tsv.gz")
 def count(infile, outfile):
     '''Counts the reads in the input BAM file using umi_tools with
@@ -224,11 +243,9 @@ def convert_tomtx(infile, outfile):
     Converts the count matrix in the input TSV file to a .mtx format.
     The output is stored in the "mtx.dir" directory.
     '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx.dir/'''
 
-    P.run(statement, job_memory="100G", job_options='-t 24:00:00')
+    P.run(statement, job_memory="16G", job_options='-t 24:00:00')
 
 
 @follows(convert_tomtx)
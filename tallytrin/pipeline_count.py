@@ -88,6 +88,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 SEQUENCESUFFIXES = ("*.fastq.gz")
 
 FASTQTARGET = tuple([os.path.join("data.dir/", suffix_name)
@@ -148,7 +155,7 @@ def merge_featurecounts_data(infiles):
 
 @follows(mkdir("processed_fastq.dir"))
 @transform(FASTQTARGET,
-         regex("data.dir/(\S+).fastq.gz"),
+         regex(r"data.dir/(\S+).fastq.gz"),
          r"processed_fastq.dir/\1_polyA.fastq.gz")
 def polya_correct(infile, outfile):
     '''
@@ -157,8 +164,6 @@ def polya_correct(infile, outfile):
     and an output file as arguments.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     if PARAMS['polya_skip']:
 
         statement = '''cp %(infile)s %(outfile)s'''
@@ -169,7 +174,7 @@ def polya_correct(infile, outfile):
     P.run(statement, job_options='-t 24:00:00')
 
 @transform(polya_correct,
-         regex("processed_fastq.dir/(\S+)_polyA.fastq.gz"),
+         regex(r"processed_fastq.dir/(\S+)_polyA.fastq.gz"),
          r"processed_fastq.dir/\1_tso_UMI.fastq.gz")
 def polya_umi(infile, outfile):
     '''
@@ -177,8 +182,6 @@ def polya_umi(infile, outfile):
     in the input file and writes the result to the output file.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     if PARAMS['no_umi']:
 
         statement = '''cp %(infile)s %(outfile)s'''
@@ -193,7 +196,7 @@ def polya_umi(infile, outfile):
 
 
 @transform(polya_umi,
-         regex("processed_fastq.dir/(\S+)_tso_UMI.fastq.gz"),
+         regex(r"processed_fastq.dir/(\S+)_tso_UMI.fastq.gz"),
          r"processed_fastq.dir/\1_polya_tso_UMI.fastq.gz")
 def tso_umi(infile, outfile):
     '''
@@ -201,8 +204,6 @@ def tso_umi(infile, outfile):
     the input file and writes the result to the output file.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
 
     if PARAMS['tso_present']:
 
@@ -220,7 +221,7 @@ def tso_umi(infile, outfile):
 
 @follows(mkdir("mapped_files.dir"))
 @transform(tso_umi,
-           regex("processed_fastq.dir/(\S+)_polya_tso_UMI.fastq.gz"),
+           regex(r"processed_fastq.dir/(\S+)_polya_tso_UMI.fastq.gz"),
            r"mapped_files.dir/\1_tso_polya_UMI.sam")
 def mapping_trans(infile, outfile):
     '''
@@ -234,7 +235,7 @@ def mapping_trans(infile, outfile):
 
 
 @transform(mapping_trans,
-           regex("mapped_files.dir/(\S+)_tso_polya_UMI.sam"),
+           regex(r"mapped_files.dir/(\S+)_tso_polya_UMI.sam"),
            r"mapped_files.dir/\1_final_sorted.bam")
 def samtools(infile, outfile):
     '''
@@ -244,15 +245,15 @@ def samtools(infile, outfile):
 
     name = outfile.replace("_final_sorted.bam", "")
 
-    statement = '''samtools view -bS %(infile)s > %(name)s_final.bam && 
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o %(name)s_final.bam %(infile)s && 
                    samtools sort %(name)s_final.bam -o %(name)s_final_sorted.bam && 
                    samtools index %(name)s_final_sorted.bam '''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(samtools,
-           regex("mapped_files.dir/(\S+)_final_sorted.bam"),
+           regex(r"mapped_files.dir/(\S+)_final_sorted.bam"),
            r"mapped_files.dir/\1_XT.bam")
 def xt_tag(infile, outfile):
     '''
@@ -260,8 +261,6 @@ def xt_tag(infile, outfile):
     writes the output to the specified outfile.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/add_XT.py --infile=%(infile)s --outname=%(outfile)s && samtools index %(outfile)s'''
 
     P.run(statement, job_options='-t 24:00:00')
@@ -269,7 +268,7 @@ def xt_tag(infile, outfile):
 
 @follows(mkdir('counts_trans.dir'))
 @transform(xt_tag,
-           regex("mapped_files.dir/(\S+)_XT.bam"),
+           regex(r"mapped_files.dir/(\S+)_XT.bam"),
            r"counts_trans.dir/\1.counts.tsv.gz")
 def count_trans(infile, outfile):
     '''Use umi-tools to collapse UMIs and generate counts table'''
@@ -280,7 +279,7 @@ def count_trans(infile, outfile):
 
 
 @transform(xt_tag,
-           regex("mapped_files.dir/(\S+)_XT.bam"),
+           regex(r"mapped_files.dir/(\S+)_XT.bam"),
            r"counts_trans.dir/\1.counts_unique.tsv.gz")
 def count_trans_unique(infile, outfile):
     '''
@@ -295,7 +294,7 @@ def count_trans_unique(infile, outfile):
 
 
 @transform(xt_tag,
-           regex("mapped_files.dir/(\S+)_XT.bam"),
+           regex(r"mapped_files.dir/(\S+)_XT.bam"),
            r"counts_trans.dir/\1.counts_noumis.tsv.gz")
 def count_trans_noumis(infile, outfile):
     '''
@@ -304,8 +303,6 @@ def count_trans_noumis(infile, outfile):
     the specified outfile.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/trans_count.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement, job_options='-t 24:00:00')
@@ -356,7 +353,7 @@ def merge_trans_noumi(infiles, outfile):
 #############################
 
 @transform(tso_umi,
-           regex("processed_fastq.dir/(\S+)_polya_tso_UMI.fastq.gz"),
+           regex(r"processed_fastq.dir/(\S+)_polya_tso_UMI.fastq.gz"),
            r"mapped_files.dir/\1_gene.sam")
 def mapping_gene(infile, outfile):
     '''
@@ -377,7 +374,7 @@ def mapping_gene(infile, outfile):
 
 
 @transform(mapping_gene,
-           regex("mapped_files.dir/(\S+)_gene.sam"),
+           regex(r"mapped_files.dir/(\S+)_gene.sam"),
            r"mapped_files.dir/\1_gene_sorted.bam")
 def samtools_sort(infile, outfile):
     '''
@@ -388,15 +385,15 @@ def samtools_sort(infile, outfile):
     name = infile.replace("_gene.sam", "")
 
     statement = '''cgat bam2bam --method=strip-sequence -L strip.log -I %(infile)s -S %(name)s_gene_strip.sam &&
-                   samtools view -bh %(name)s_gene_strip.sam > %(name)s_gene.bam &&
+                   samtools view -b -@ %(job_threads)s --no-PG -o %(name)s_gene.bam %(name)s_gene_strip.sam &&
                    samtools sort %(name)s_gene.bam -o %(name)s_gene_sorted.bam &&
                    samtools index %(name)s_gene_sorted.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(samtools_sort,
-           regex("mapped_files.dir/(\S+)_gene_sorted.bam"),
+           regex(r"mapped_files.dir/(\S+)_gene_sorted.bam"),
            r"mapped_files.dir/\1_featurecounts_gene_sorted.bam")
 def featurecounts(infile, outfile):
     '''
@@ -414,7 +411,7 @@ def featurecounts(infile, outfile):
 
 @follows(mkdir('counts_genes.dir'))
 @transform(featurecounts,
-           regex("mapped_files.dir/(\S+)_featurecounts_gene_sorted.bam"),
+           regex(r"mapped_files.dir/(\S+)_featurecounts_gene_sorted.bam"),
            r"counts_genes.dir/\1.counts_gene.tsv.gz")
 def count_gene(infile, outfile):
     '''
@@ -438,7 +435,7 @@ def merge_count_gene(infiles, outfile):
 
 
 @transform(featurecounts,
-           regex("mapped_files.dir/(\S+)_featurecounts_gene_sorted.bam"),
+           regex(r"mapped_files.dir/(\S+)_featurecounts_gene_sorted.bam"),
            r"counts_genes.dir/\1.count_gene_unique.tsv.gz")
 def count_gene_unique(infile, outfile):
     '''Use umi-tools to collapse UMIs and generate counts table'''
@@ -482,12 +479,11 @@ def merge_featurecounts(outfile):
 
 @follows(mkdir('counts_trans_greedy.dir'))
 @transform(xt_tag,
-           regex("mapped_files.dir/(\S+)_XT.bam"),
+           regex(r"mapped_files.dir/(\S+)_XT.bam"),
            r"counts_trans_greedy.dir/\1.counts_greedy.txt")
 def count_trans_greedy(infile, outfile):
     '''Use greedy to collapse UMIs'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
     
     statement = '''python %(PYTHON_ROOT)s/greedy_bulk.py count -i %(infile)s
                    -t XT -o %(outfile)s'''
@@ -502,13 +498,11 @@ def count_trans_greedy(infile, outfile):
 @active_if(PARAMS['no_umi'])
 @follows(mkdir('counts_trans.dir'))
 @transform(samtools,
-           regex("mapped_files.dir/(\S+)_final_sorted.bam"),
+           regex(r"mapped_files.dir/(\S+)_final_sorted.bam"),
            r"counts_trans.dir/\1_counts_noumi.tsv")
 def count_trans_noumi(infile, outfile):
     '''Count the reads for every gene'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python  %(PYTHON_ROOT)s/trans_count.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement, job_options='-t 24:00:00')
@@ -82,6 +82,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 SEQUENCESUFFIXES = ("*.bam")
 
 FASTQTARGET = tuple([os.path.join("data.dir/", suffix_name)
@@ -90,7 +97,7 @@ FASTQTARGET = tuple([os.path.join("data.dir/", suffix_name)
 
 
 @transform("data.dir/*.bam",
-         regex("data.dir/(\S+).bam"),
+         regex(r"data.dir/(\S+).bam"),
          r"\1_SA.bam")
 def make_sabam(infile, outfile):
     '''
@@ -127,7 +134,7 @@ def tabix_bed(infile, outfile):
 
 
 @transform(make_sabam,
-           regex("(\S+).bam"),
+           regex(r"(\S+).bam"),
            add_inputs(tabix_bed),
            r"\1_FusionAnnotate.bam")
 def fusion_annotate(infiles, outfile):
@@ -138,15 +145,13 @@ def fusion_annotate(infiles, outfile):
     infile, bed = infiles
     bed = bed.replace(".tbi", "")
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python  %(PYTHON_ROOT)s/fusion_annotate.py --infile=%(infile)s --outfile=%(outfile)s --bedfile=%(bed)s'''
 
     P.run(statement, job_options="-t 24:00:00")
 
 
 @transform(fusion_annotate,
-           regex("(\S+)_FusionAnnotate.bam"),
+           regex(r"(\S+)_FusionAnnotate.bam"),
            add_inputs(tabix_bed),
            r"\1_FinalAnnotate.bam")
 def gene_annotate(infiles, outfile):
@@ -158,8 +163,6 @@ def gene_annotate(infiles, outfile):
     bed = bed.replace(".tbi", "")
     outfile_tmp = outfile + ".tmp"
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python  %(PYTHON_ROOT)s/gene_annotate.py --infile=%(infile)s --outfile=%(outfile_tmp)s --bedfile=%(bed)s &&
                    samtools sort %(outfile_tmp)s -o %(outfile)s &&
                    rm -rf %(outfile_tmp)s'''
@@ -168,7 +171,7 @@ def gene_annotate(infiles, outfile):
 
 
 @transform(gene_annotate,
-           regex("(\S+)_FinalAnnotate.bam"),
+           regex(r"(\S+)_FinalAnnotate.bam"),
            [r"\1_fusion1.bed", r"\1_fusion2.bed"])
 def generate_bedout(infile, outfiles):
     '''
@@ -176,8 +179,6 @@ def generate_bedout(infile, outfiles):
     '''
 
     outfile1, outfile2 = outfiles
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/bed_fusion.py --infile=%(infile)s --bed1=%(outfile1)s --bed2=%(outfile2)s'''
 
     P.run(statement, job_options="-t 24:00:00")
@@ -193,8 +194,6 @@ def generate_counts(infiles, outfile):
 
     bed1, bed2 = infiles
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/generate_counts.py --bed1=%(bed1)s --bed2=%(bed2)s --outfile=%(outfile)s'''
 
     P.run(statement, job_options="-t 24:00:00")
@@ -18,8 +18,7 @@ Pipeline tasks
 The code consists of several functions, each handling a specific step in the processing and analysis of the input FASTQ files.
 
 * UMI Correction: The correct_umis() function corrects the UMI sequences in the input Illumina data by processing read1 and read2 FASTQ files.
-* Read Mapping: The map_hisat2() function maps the reads to a reference genome using HISAT2, a fast and efficient read aligner.
-* SAM to BAM Conversion and Sorting: The run_samtools() function converts the output SAM files from the read mapping step into BAM format, sorts them, and indexes the sorted BAM files.
+* Read Mapping: The map_hisat2() function maps the reads to a reference genome using HISAT2, a fast and efficient read aligner, piping the alignments into samtools sort to produce a sorted, indexed BAM file.
 * Feature Counting: The featurecounts() function runs featureCounts to count the number of reads associated with each genomic feature (e.g., gene) and outputs a BAM file.
 * Gene Counting with UMIs: The count_genes() function uses UMI-tools to count the reads for each gene, considering the UMIs.
 * Gene Counting without UMIs: The count_genes_noumis() function uses UMI-tools to count the reads for each gene without considering the UMIs (unique method).
@@ -64,6 +63,12 @@ You can run the pipeline locally (without a cluster) using --local
 
 tallytrin illumina make full -v5 --local
 
+The tail tasks of the pipeline (count_genes, count_genes_noumis,
+merge_genes, merge_genes_noumi and merge_featurecounts) are independent
+of each other, so allow several jobs to run concurrently with -p:
+
+tallytrin illumina make full -v5 -p 8
+
 
 Code
 ==================
@@ -76,7 +81,6 @@ import os
 import re
 import sqlite3
 import glob
-import pandas as pd
 
 import cgatcore.pipeline as P
 import cgatcore.experiment as E
@@ -89,6 +93,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 # Determine the location of the input fastq files
 try:
     PARAMS['data']
@@ -111,7 +122,7 @@ SEQUENCEFILES = tuple([os.path.join(DATADIR, suffix_name)
 
 @follows(mkdir("corrected_umis.dir"))
 @transform(SEQUENCEFILES,
-           regex("data.dir/(\S+).fastq.1.gz"),
+           regex(r"data.dir/(\S+).fastq.1.gz"),
            r"corrected_umis.dir/\1_corrected.fastq.gz")
 def correct_umis(infile, outfile):
     '''
@@ -122,11 +133,6 @@ def correct_umis(infile, outfile):
     read1 = infile
     read2 = infile.replace(".fastq.1.gz", ".fastq.2.gz")
 
-    name = infile.replace("", ".fastq.1.gz")
-    name = name.replace("data.dir/", "")
-
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
 
     if PARAMS["correct"]:
         statement = '''python %(PYTHON_ROOT)s/correct_illumina_umi.py --read1=%(read1)s --read2=%(read2)s --outname=%(outfile)s --errors=%(errors)s'''
@@ -138,35 +144,24 @@ def correct_umis(infile, outfile):
 
 
 @transform(correct_umis,
-           regex("corrected_umis.dir/(\S+)_corrected.fastq.gz"),
-           r"mapped.dir/\1.sam")
+           regex(r"corrected_umis.dir/(\S+)_corrected.fastq.gz"),
+           r"mapped.dir/\1_sorted.bam")
 def map_hisat2(infile, outfile):
     """
-    Maps the reads using HISAT2.
+    Maps the reads using HISAT2 and pipes the alignments straight into
+    samtools sort, so no SAM intermediate is written. The sorted BAM
+    file is then indexed.
     """
 
-    statement = """hisat2 -x %(hisat2_index)s -U %(infile)s -S %(outfile)s"""
+    statement = """hisat2 -p %(hisat2_threads)s -x %(hisat2_index)s -U %(infile)s |
+                   samtools sort -@ %(samtools_threads)s -O bam -o %(outfile)s - &&
+                   samtools index -@ %(samtools_threads)s %(outfile)s"""
 
     P.run(statement, job_options='-t 24:00:00')
 
 
 @transform(map_hisat2,
-           regex("mapped.dir/(\S+).sam"),
-           r"mapped.dir/\1_sorted.bam")
-def run_samtools(infile, outfile):
-    """
-    Converts SAM files to BAM, sorts them, and indexes the sorted BAM files.
-    """
-
-    statement = """samtools view -bh  %(infile)s > %(infile)s_final_gene.bam &&
-                   samtools sort %(infile)s_final_gene.bam -o %(outfile)s &&
-                   samtools index %(outfile)s"""
-    
-    P.run(statement)
-
-
-@transform(run_samtools,
-           regex("mapped.dir/(\S+)_sorted.bam"),
+           regex(r"mapped.dir/(\S+)_sorted.bam"),
            r"mapped.dir/\1_Aligned_final_gene_sorted.bam")
 def featurecounts(infile, outfile):
     """
@@ -176,16 +171,16 @@ def featurecounts(infile, outfile):
 
     name = outfile.replace("_Aligned_final_gene_sorted.bam", "_gene_assigned")
 
-    statement = """featureCounts -a %(gtf)s -o %(name)s -R BAM %(infile)s &&
-                   samtools sort %(infile)s.featureCounts.bam  -o %(outfile)s &&
-                   samtools index %(outfile)s"""
+    statement = """featureCounts -T %(featurecounts_threads)s -a %(gtf)s -o %(name)s -R BAM %(infile)s &&
+                   samtools sort -@ %(samtools_threads)s %(infile)s.featureCounts.bam  -o %(outfile)s &&
+                   samtools index -@ %(samtools_threads)s %(outfile)s"""
 
     P.run(statement, job_options='-t 24:00:00')
 
 
 @follows(mkdir("featurecounts.dir"))
 @transform(featurecounts,
-           regex("mapped.dir/(\S+)_Aligned_final_gene_sorted.bam"),
+           regex(r"mapped.dir/(\S+)_Aligned_final_gene_sorted.bam"),
            r"featurecounts.dir/\1_counts_genes.tsv.gz")
 def count_genes(infile, outfile):
     '''
@@ -198,7 +193,7 @@ def count_genes(infile, outfile):
 
 
 @transform(featurecounts,
-           regex("mapped.dir/(\S+)_Aligned_final_gene_sorted.bam"),
+           regex(r"mapped.dir/(\S+)_Aligned_final_gene_sorted.bam"),
            r"featurecounts.dir/\1_counts_genes_noumis.tsv.gz")
 def count_genes_noumis(infile, outfile):
     '''
@@ -210,21 +205,54 @@ def count_genes_noumis(infile, outfile):
     P.run(statement)
 
 
-def merge_featurecounts_data(infiles):
+def read_counts_column(infile, skiprows=0):
     '''
-    Merges the input files from featureCounts and returns a DataFrame with the counts for each gene.
+    Reads only the identifier and final counts column of a featureCounts
+    or umi_tools table, using the multithreaded pyarrow parser when it
+    is available.
     '''
 
-    final_df = pd.DataFrame()
-    for infile in infiles:
-    
-        tmp_df = pd.read_table(infile, sep="\t", header=0, index_col=0, skiprows = 0, compression='gzip')
-        tmp_df = tmp_df.iloc[:,-1:]
-        tmp_df.columns = ["count"]
-        final_df = final_df.merge(tmp_df, how="outer", left_index=True, right_index=True, suffixes=("","_drop"))
-
-    names = [x.replace("", "") for x in infiles]
-    final_df.columns = names
+    import pandas as pd
+
+    cols = pd.read_table(infile, sep="\t", nrows=0, skiprows=skiprows).columns
+
+    kwargs = {}
+    if skiprows == 0:
+        # the pyarrow engine does not combine skiprows with usecols, so
+        # only use it on the plain counts tables
+        try:
+            import pyarrow
+            kwargs["engine"] = "pyarrow"
+        except ImportError:
+            pass
+
+    tmp_df = pd.read_table(infile, sep="\t", header=0, index_col=0,
+                           skiprows=skiprows, usecols=[cols[0], cols[-1]],
+                           **kwargs)
+    return tmp_df.iloc[:,-1]
+
+
+def merge_featurecounts_data(infiles, names=None):
+    '''
+    Merges the input files from featureCounts and returns a DataFrame with
+    the counts for each gene, labelled with names (the file paths when no
+    names are given).
+    '''
+
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor
+
+    if names is None:
+        names = infiles
+
+    # gzip decompression releases the GIL, so threads parse the
+    # input files in parallel
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(infiles)))) as executor:
+        columns = list(executor.map(read_counts_column, infiles))
+
+    series = [column.rename(name) for column, name in zip(columns, names)]
+
+    final_df = pd.concat(series, axis=1, join="outer")
     return final_df
 
 @follows(count_genes)
@@ -234,10 +262,9 @@ def merge_genes(outfile):
     Merges the gene count data from featureCounts with UMI consideration into a single output file.
     '''
 
-    infiles = glob.glob("featurecounts.dir/*_counts_genes.tsv.gz")
-    final_df = merge_featurecounts_data(infiles)
+    infiles = sorted(glob.glob("featurecounts.dir/*_counts_genes.tsv.gz"))
     names = [x.replace("_counts_genes.tsv.gz", "") for x in infiles]
-    final_df.columns = names
+    final_df = merge_featurecounts_data(infiles, names)
     df = final_df.fillna(0)
     df.to_csv(outfile, sep="\t", compression="gzip")
 
@@ -249,10 +276,9 @@ def merge_genes_noumi(outfile):
     Merges the gene count data from featureCounts without UMI consideration into a single output file.
     '''
 
-    infiles = glob.glob("featurecounts.dir/*_counts_genes_noumis.tsv.gz")
-    final_df = merge_featurecounts_data(infiles)
+    infiles = sorted(glob.glob("featurecounts.dir/*_counts_genes_noumis.tsv.gz"))
     names = [x.replace("_counts_genes_noumis.tsv.gz", "") for x in infiles]
-    final_df.columns = names
+    final_df = merge_featurecounts_data(infiles, names)
     df = final_df.fillna(0)
     df.to_csv(outfile, sep="\t", compression="gzip")
 
@@ -265,18 +291,18 @@ def merge_featurecounts(outfile):
     file with gene counts without UMI consideration.
     '''
 
-    infiles = glob.glob("mapped.dir/*_gene_assigned")
-    final_df = pd.DataFrame()
+    import pandas as pd
+
+    infiles = sorted(glob.glob("mapped.dir/*_gene_assigned"))
+    series = []
 
     for infile in infiles:
-    
-        tmp_df = pd.read_table(infile, sep="\t", header=0, index_col=0, skiprows = 1)
-        tmp_df = tmp_df.iloc[:,-1:]
-        tmp_df.columns = ["count"]
-        final_df = final_df.merge(tmp_df, how="outer", left_index=True, right_index=True, suffixes=("","_drop"))
-    names = [x.replace("_gene_assigned", "") for x in infiles]
-    final_df.columns = names
-    
+
+        name = infile.replace("_gene_assigned", "")
+        series.append(read_counts_column(infile, skiprows=1).rename(name))
+
+    final_df = pd.concat(series, axis=1, join="outer")
+
     df = final_df.fillna(0)
     df.to_csv(outfile, sep="\t", compression="gzip")
 
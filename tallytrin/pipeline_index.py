@@ -43,9 +43,7 @@ Code
 """
 import sys
 import os
-import pysam
 import glob
-import pandas as pd
 from ruffus import *
 import cgatcore.iotools as iotools
 import cgatcore.pipeline as P
@@ -59,6 +57,15 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+BASH_ROOT = os.path.join(os.path.dirname(__file__), "bash")
+PARAMS["BASH_ROOT"] = BASH_ROOT
+
+
 SEQUENCESUFFIXES = ("*.fastq.gz")
 
 FASTQTARGET = tuple([os.path.join("data.dir/", suffix_name)
@@ -67,7 +74,7 @@ FASTQTARGET = tuple([os.path.join("data.dir/", suffix_name)
 
 @follows(mkdir("split_tmp.dir"))
 @transform('data.dir/*.fastq.gz',
-           regex('data.dir/(\S+).fastq.gz'),
+           regex(r'data.dir/(\S+).fastq.gz'),
            r"split_tmp.dir/\1.aa")
 def split_fastq(infile, outfile):
     '''
@@ -78,44 +85,26 @@ def split_fastq(infile, outfile):
     name = infile.replace('data.dir/','')
     name = name.replace('.fastq.gz','')
 
-    statement = '''zcat %(infile)s | split -l %(split)s - %(name)s. &&
-                   mv %(name)s*.* split_tmp.dir/'''
+    statement = '''python %(PYTHON_ROOT)s/split_fastq.py --infile=%(infile)s --prefix=split_tmp.dir/%(name)s. --lines=%(split)s'''
 
     P.run(statement)
 
 
 @follows(split_fastq)
-@follows(mkdir("polyA_correct.dir"))
-@transform('split_tmp.dir/*',
-           regex("split_tmp.dir/(\S+)"),
-           r"polyA_correct.dir/\1_correct_polya.fastq")
-def correct_polyA(infile, outfile):
-    '''
-    Look across all fastq files and correct the polyA so its on same strand
-    '''
-
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/complement_polyA.py --infile=%(infile)s --outname=%(outfile)s'''
-
-    P.run(statement)
-
-
-@follows(correct_polyA)
 @follows(mkdir("seperate_samples.dir"))
-@transform('polyA_correct.dir/*.fastq',
-           regex("polyA_correct.dir/(\S+)_correct_polya.fastq"),
+@transform('split_tmp.dir/*',
+           regex(r"split_tmp.dir/(\S+)"),
            r"seperate_samples.dir/\1.fastq")
 def separate_by_index(infile, outfile):
     '''
-    Identify barcode and save to different samples
+    Correct the polyA so its on same strand, then identify the
+    barcode and save to different samples in a single pass over
+    each split file.
     '''
     primer = PARAMS['primer']
     name = outfile.replace("seperate_samples.dir/", "")
     name = name.replace(".fastq", "")
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/identify_index.py --infile=%(infile)s --name=%(name)s
                    --primer=%(primer)s && touch %(outfile)s'''
 
@@ -129,8 +118,6 @@ def merge_by_index(outfile):
     Identify barcode and save to different samples
     '''
 
-    BASH_ROOT = os.path.join(os.path.dirname(__file__), "bash/")
-
     statement = '''bash %(BASH_ROOT)s/cat_files.sh && touch %(outfile)s'''
 
     P.run(statement)
@@ -138,7 +125,7 @@ def merge_by_index(outfile):
 
 @follows(merge_by_index)
 @transform('*.fastq.gz',
-           regex("(\S+).fastq.gz"),
+           regex(r"(\S+).fastq.gz"),
            r"\1.counts.txt")
 def read_count(infile, outfile):
     '''
@@ -157,7 +144,6 @@ def merge_counts(outfile):
     Merge counts for  different samples
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
     
     statement = '''python %(PYTHON_ROOT)s/merge_counts.py '''
 
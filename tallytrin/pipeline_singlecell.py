@@ -21,8 +21,7 @@ The pipeline performs the following steps:
 Reads the pipeline configuration from the pipeline.yml file.
 Splits the input fastq file into smaller pieces.
 Performs quality control on the split files by correcting the polyA tail and identifying barcode and UMI sequences.
-Merges the corrected reads and maps them to a transcriptome genome using minimap2.
-Converts the SAM file to BAM format and sorts the BAM file using samtools.
+Merges the corrected reads and maps them to a transcriptome genome using minimap2, piping the alignments directly into samtools sort to produce a sorted BAM file.
 Adds transcript name to XT tag in the BAM file to facilitate UMI-tools counting.
 Counts the reads using UMI-tools and generates gene-level and transcript-level counts matrices in market matrix format.
 Saves the final outputs in the mtx.dir/ and mtx_gene.dir/ directories.
@@ -95,6 +94,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 # Determine the location of the input fastq files
 
 try:
@@ -116,27 +122,41 @@ SEQUENCEFILES = tuple([os.path.join(DATADIR, suffix_name)
                        for suffix_name in SEQUENCESUFFIXES])
 
 
+@files(PARAMS['minimap2_fasta_cdna'],
+       PARAMS['minimap2_fasta_cdna'] + ".mmi")
+def build_mm2_index(infile, outfile):
+    '''
+    Builds the minimap2 index for the transcriptome once, so the mapping
+    stages reuse the .mmi instead of each re-indexing the cDNA FASTA.
+    '''
+
+    options = PARAMS['minimap2_options']
+
+    statement = '''minimap2 %(options)s -d %(outfile)s %(infile)s'''
+
+    P.run(statement, job_threads=PARAMS['default_threads'])
+
+
 @follows(mkdir("split_tmp.dir"))
-@split(DATADIR + '/*.fastq.gz', "split_tmp.dir/out*")
+@split(DATADIR + '/*.fastq.gz', "split_tmp.dir/*.part_*.fastq.gz")
 def split_fastq(infile, outfiles):
     '''
-    Splits the input FASTQ file into smaller pieces using the seqkit split
-    command. This function takes an input FASTQ file and creates multiple
-    smaller FASTQ files based on the desired split size specified in the
-    configuration.
+    Splits the input FASTQ file into smaller pieces using seqkit split2,
+    which chunks records natively - no read can be broken mid-record -
+    and reads the gzipped input with threaded decompression. The number
+    of chunks is set by the nchunks parameter in the configuration.
     '''
 
     infile = "".join(infile)
 
-    statement = '''zcat %(infile)s | split -l %(split)s - out. &&
-                   mv out*.* split_tmp.dir/'''
+    statement = '''seqkit split2 -j %(job_threads)s -p %(nchunks)s -O split_tmp.dir/ %(infile)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @follows(mkdir("polyA_correct.dir"))
 @transform(split_fastq,
-           regex("split_tmp.dir/out.(\S+)"),
+           regex(r"split_tmp.dir/(\S+)\.fastq\.gz"),
            r"polyA_correct.dir/\1_correct_polya.fastq")
 def correct_polyA(infile, outfile):
     '''
@@ -146,8 +166,6 @@ def correct_polyA(infile, outfile):
     split FASTQ file and generates a corrected FASTQ file.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/complement_polyA_singlecell.py --infile=%(infile)s --outname=%(outfile)s'''
 
     P.run(statement)
@@ -155,7 +173,7 @@ def correct_polyA(infile, outfile):
 
 @follows(mkdir("polyA_umi.dir"))
 @transform(correct_polyA,
-           regex("polyA_correct.dir/(\S+)_correct_polya.fastq"),
+           regex(r"polyA_correct.dir/(\S+)_correct_polya.fastq"),
            r"polyA_umi.dir/\1.fastq.gz")
 def identify_bcumi(infile, outfile):
     '''
@@ -168,11 +186,9 @@ def identify_bcumi(infile, outfile):
     name = outfile.replace("polyA_umi.dir/", "")
     name = name.replace(".fastq.gz", "")
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/identify_perfect_nano.py --outfile=%(outfile)s --infile=%(infile)s --whitelist=polyA_umi.dir/%(name)s.whitelist.txt'''
+    statement = '''python %(PYTHON_ROOT)s/identify_perfect_nano.py --outfile=%(outfile)s --infile=%(infile)s --whitelist=polyA_umi.dir/%(name)s.whitelist.txt --processes=%(job_threads)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 
@@ -190,7 +206,7 @@ def merge_whitelist(infiles, outfile):
 
     whitelist_files = " ".join(whitelists)
 
-    statement = '''cat %(whitelist_files)s | sort | uniq > %(outfile)s'''
+    statement = '''awk '!seen[$0]++' %(whitelist_files)s > %(outfile)s'''
 
     P.run(statement)
 
@@ -198,73 +214,49 @@ def merge_whitelist(infiles, outfile):
 
 @follows(mkdir("correct_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            r"correct_reads.dir/\1.fastq.gz")
 def correct_reads(infile, outfile):
     '''Correct the barcodes using majority vote'''
 
     infile = infile
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
 
     statement = '''python %(PYTHON_ROOT)s/correct_barcode_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
 
-@merge(correct_reads, "merge_corrected.fastq.gz")
-def merge_correct_reads(infiles, outfile):
-    '''Merge the corrected reads '''
-
-    infile = []
-
-    for i in infiles:
-        infile.append(str(i))
-
-    infile_join = " ".join(infile)
-
-
-
-    statement = '''cat %(infile_join)s > %(outfile)s'''
-
-    P.run(statement)
-
-
-@transform(merge_correct_reads,
-           regex("merge_corrected.fastq.gz"),
-           r"final.sam")
-def mapping(infile, outfile):
+@follows(build_mm2_index)
+@merge(correct_reads, "final_sorted.bam")
+def mapping(infiles, outfile):
     '''
-    Maps the reads from the merged FASTQ file to a transcriptome genome using
-    the minimap2 aligner. This function takes an input merged FASTQ file
-    and generates a SAM (Sequence Alignment/Map) file containing the
-    read alignments.
+    Maps the corrected reads to a transcriptome genome using the minimap2
+    aligner, streaming the per-chunk FASTQ files into the aligner through
+    process substitution and piping the alignments straight into samtools
+    sort. Neither a concatenated FASTQ nor a SAM intermediate is written
+    to disk.
     '''
 
+    infile_join = " ".join(infiles)
 
     cdna = PARAMS['minimap2_fasta_cdna']
+    mmi = cdna + ".mmi"
     options = PARAMS['minimap2_options']
 
-    statement = '''minimap2  %(options)s %(cdna)s  %(infile)s > %(outfile)s 2> %(outfile)s.log'''
-
-    P.run(statement)
+    if PARAMS['use_gpu']:
+        statement = '''cat %(infile_join)s > %(outfile)s.fastq.gz &&
+                       pbrun minimap2 --gpusort --ref %(cdna)s --in-fq %(outfile)s.fastq.gz --out-bam %(outfile)s &&
+                       samtools index -@ %(samtools_threads)s %(outfile)s &&
+                       rm %(outfile)s.fastq.gz'''
+        P.run(statement, job_threads=PARAMS['default_threads'], job_queue=PARAMS['gpu_queue'])
+    else:
+        statement = '''minimap2 -t %(job_threads)s %(options)s %(mmi)s <(pigz -cd -p 4 %(infile_join)s) 2> %(outfile)s.log |
+                       samtools sort -@ %(samtools_threads)s -m %(samtools_mem)s --write-index -o %(outfile)s##idx##%(outfile)s.bai -'''
+        P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @transform(mapping,
-           regex("final.sam"),
-           r"final_sorted.bam")
-def run_samtools(infile, outfile):
-    '''convert sam to bam and sort -F 272'''
-
-    statement = '''samtools view -bS %(infile)s > final.bam &&
-                   samtools sort final.bam -o final_sorted.bam &&
-                   samtools index final_sorted.bam'''
-
-    P.run(statement)
-
-
-@transform(run_samtools,
            regex("final_sorted.bam"),
            r"final_XT.bam")
 def add_xt_tag(infile, outfile):
@@ -275,41 +267,37 @@ def add_xt_tag(infile, outfile):
     transcript information.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
 
 @transform(add_xt_tag,
            regex("final_XT.bam"),
-           r"counts.tsv.gz")
+           r"counts.tsv.zst")
 def count(infile, outfile):
     '''
-    Counts the reads in the BAM file with XT tags using the umi_tools package.
-    The counting is performed per gene and using a unique method.
+    Counts the unique UMIs per gene and cell in the BAM file with XT tags
+    using a single-pass hashmap scan (fast_unique_count.py), which matches
+    umi_tools count --method unique without its per-gene network overhead.
     '''
 
-    statement = '''umi_tools count --method unique --per-gene --gene-tag=XT --per-cell  -I %(infile)s -S counts.tsv.gz'''
+    statement = '''python %(PYTHON_ROOT)s/fast_unique_count.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
 
 @follows(mkdir("mtx.dir"))
 @transform(count,
-           regex("counts.tsv.gz"),
+           regex("counts.tsv.zst"),
            r"mtx.dir/genes.mtx")
 def convert_tomtx(infile, outfile):
     '''
     This function takes an input BAM file with XT tags and generates a counts matrix file in the MTX format.
     '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx.dir/'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 @merge(identify_bcumi, "merge_uncorrected.fastq.gz")
@@ -325,11 +313,12 @@ def merge_uncorrect_reads(infiles, outfile):
 
 
 
-    statement = '''cat %(infile_join)s > %(outfile)s'''
+    statement = '''pigz -cd -p 4 %(infile_join)s | pigz -p %(job_threads)s -c > %(outfile)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
+@follows(build_mm2_index)
 @transform(merge_uncorrect_reads,
            regex("merge_uncorrected.fastq.gz"),
            r"final_uncorrected.sam")
@@ -338,24 +327,27 @@ def mapping_trimer(infile, outfile):
 
 
     cdna = PARAMS['minimap2_fasta_cdna']
+    mmi = cdna + ".mmi"
     options = PARAMS['minimap2_options']
 
-    statement = '''minimap2  %(options)s %(cdna)s  %(infile)s > %(outfile)s 2> %(outfile)s.log'''
-
-    P.run(statement)
+    if PARAMS['use_gpu']:
+        statement = '''pbrun minimap2 --ref %(cdna)s --in-fq %(infile)s --out-bam %(outfile)s.bam &&
+                       samtools view -h -@ %(job_threads)s -o %(outfile)s %(outfile)s.bam'''
+        P.run(statement, job_threads=PARAMS['default_threads'], job_queue=PARAMS['gpu_queue'])
+    else:
+        statement = '''minimap2 -t %(job_threads)s %(options)s %(mmi)s  %(infile)s > %(outfile)s 2> %(outfile)s.log'''
+        P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @follows(mkdir("collapse_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            r"collapse_reads.dir/\1.fastq.gz")
 def collapse_reads(infile, outfile):
     '''Correct the barcodes by picking first ucleotide in the barcode and umi'''
 
     infile = infile
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
 
     statement = '''python %(PYTHON_ROOT)s/single_nucleotide_select.py --infile=%(infile)s --outfile=%(outfile)s'''
 
@@ -375,101 +367,88 @@ def merge_singlenuc_reads(infiles, outfile):
 
 
 
-    statement = '''cat %(infile_join)s > %(outfile)s'''
+    statement = '''pigz -cd -p 4 %(infile_join)s | pigz -p %(job_threads)s -c > %(outfile)s'''
 
-    P.run(statement)
+    P.run(statement, job_threads=PARAMS['default_threads'])
 
 
+@follows(build_mm2_index)
 @transform(merge_singlenuc_reads,
            regex("merge_collapsed.fastq.gz"),
-           r"final_collapsed.sam")
+           r"final_sorted_collapsed.bam")
 def mapping_collapsed(infile, outfile):
-    '''Run minimap2 to map the fastq file'''
+    '''Run minimap2 to map the fastq file and sort the alignments'''
 
 
     cdna = PARAMS['minimap2_fasta_cdna']
+    mmi = cdna + ".mmi"
     options = PARAMS['minimap2_options']
 
-    statement = '''minimap2  %(options)s %(cdna)s  %(infile)s > %(outfile)s 2> %(outfile)s.log'''
-
-    P.run(statement)
-
+    if PARAMS['use_gpu']:
+        statement = '''pbrun minimap2 --gpusort --ref %(cdna)s --in-fq %(infile)s --out-bam %(outfile)s &&
+                       samtools index -@ %(samtools_threads)s %(outfile)s'''
+        P.run(statement, job_threads=PARAMS['default_threads'], job_queue=PARAMS['gpu_queue'])
+    else:
+        statement = '''minimap2 -t %(job_threads)s %(options)s %(mmi)s %(infile)s 2> %(outfile)s.log |
+                       samtools sort -@ %(samtools_threads)s -m %(samtools_mem)s --write-index -o %(outfile)s##idx##%(outfile)s.bai -'''
+        P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @transform(mapping_collapsed,
-           regex("final_collapsed.sam"),
-           r"final_sorted_collapsed.bam")
-def run_samtools_collapsed(infile, outfile):
-    '''convert sam to bam and sort -F 272'''
-
-    statement = '''samtools view -bS %(infile)s > final_collapsed.bam &&
-                   samtools sort final_collapsed.bam -o final_sorted_collapsed.bam &&
-                   samtools index final_sorted_collapsed.bam'''
-
-    P.run(statement)
-
-
-@transform(run_samtools_collapsed,
            regex("final_sorted_collapsed.bam"),
            r"final_XT_collapsed.bam")
 def add_xt_tag_collapsed(infile, outfile):
     '''Add trancript name to XT tag in bam file so umi-tools counts can be  perfromed'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
 
 @transform(add_xt_tag_collapsed,
            regex("final_XT_collapsed.bam"),
-           r"counts_collapsed.tsv.gz")
+           r"counts_collapsed.tsv.zst")
 def count_collapsed(infile, outfile):
-    '''use umi_tools to count the reads - need to adapt umi tools to double oligo'''
+    '''count the unique UMIs per gene and cell with a single-pass hashmap scan'''
 
-    statement = '''umi_tools count --method unique --per-gene --gene-tag=XT --per-cell  -I %(infile)s -S %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/fast_unique_count.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
 
 @follows(mkdir("mtx_collapsed.dir"))
 @transform(count_collapsed,
-           regex("counts_collapsed.tsv.gz"),
+           regex("counts_collapsed.tsv.zst"),
            r"mtx_collapsed.dir/genes.mtx")
 def convert_tomtx_collapsed(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_collapsed.dir/ --filter=3'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 
 @transform(add_xt_tag_collapsed,
            regex("final_XT_collapsed.bam"),
-           r"counts_collapsed_directional.tsv.gz")
+           r"counts_collapsed_directional.tsv.zst")
 def count_collapsed_direction(infile, outfile):
     '''use umi_tools to count the reads - need to adapt umi tools to double oligo'''
 
-    statement = '''umi_tools count  --per-gene --gene-tag=XT --per-cell  -I %(infile)s -S %(outfile)s'''
+    statement = '''umi_tools count  --per-gene --gene-tag=XT --per-cell  -I %(infile)s -L %(outfile)s.log -S /dev/stdout |
+                   zstd -T0 -3 -f -o %(outfile)s'''
 
     P.run(statement)
 
 
 @follows(mkdir("mtx_collapsed_directional.dir"))
 @transform(count_collapsed_direction,
-           regex("counts_collapsed_directional.tsv.gz"),
+           regex("counts_collapsed_directional.tsv.zst"),
            r"mtx_collapsed_directional.dir/genes.mtx")
 def convert_tomtx_directional(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_collapsed_directional.dir/ --filter=3'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 ###########################################################################
@@ -480,61 +459,37 @@ def convert_tomtx_directional(infile, outfile):
 # running ILP
 
 
-@merge(correct_reads, "merge_trimer.fastq.gz")
-def merge_trimer_bcumi(infiles, outfile):
-    '''Merge the fastq reads with uncollapsed trime reads '''
-
-    infile = []
-
-    for i in infiles:
-        infile.append(str(i))
-
-    infile_join = " ".join(infile)
-
-
+@follows(build_mm2_index)
+@merge(correct_reads, "final_sorted_trimer.bam")
+def run_minimap2_trimer(infiles, outfile):
+    '''Run minimap2 on the fastq chunks with trimer UMIs, streamed through
+    process substitution, and sort the alignments'''
 
-    statement = '''cat %(infile_join)s > %(outfile)s'''
-
-    P.run(statement)
-
-
-@transform(merge_trimer_bcumi,
-           regex("merge_trimer.fastq.gz"),
-           r"final_trimer.sam")
-def run_minimap2_trimer(infile, outfile):
-    '''Run minimap2 using fastq files with trimer UMIs'''  
+    infile_join = " ".join(infiles)
 
     cdna = PARAMS['minimap2_fasta_cdna']
+    mmi = cdna + ".mmi"
     options = PARAMS['minimap2_options']
 
-    statement = '''minimap2  %(options)s %(cdna)s  %(infile)s > %(outfile)s 2> %(outfile)s.log'''
-
-    P.run(statement)
+    if PARAMS['use_gpu']:
+        statement = '''cat %(infile_join)s > %(outfile)s.fastq.gz &&
+                       pbrun minimap2 --gpusort --ref %(cdna)s --in-fq %(outfile)s.fastq.gz --out-bam %(outfile)s &&
+                       samtools index -@ %(samtools_threads)s %(outfile)s &&
+                       rm %(outfile)s.fastq.gz'''
+        P.run(statement, job_threads=PARAMS['default_threads'], job_queue=PARAMS['gpu_queue'])
+    else:
+        statement = '''minimap2 -t %(job_threads)s %(options)s %(mmi)s <(pigz -cd -p 4 %(infile_join)s) 2> %(outfile)s.log |
+                       samtools sort -@ %(samtools_threads)s -m %(samtools_mem)s --write-index -o %(outfile)s##idx##%(outfile)s.bai -'''
+        P.run(statement, job_threads=PARAMS['default_threads'])
 
 
 @transform(run_minimap2_trimer,
-           regex("final_trimer.sam"),
-           r"final_sorted_trimer.bam")
-def run_samtools_trimer(infile, outfile):
-    '''convert sam to bam and sort -F 272'''
-
-    statement = '''samtools view -bS %(infile)s > final_trimer.bam &&
-                   samtools sort final_trimer.bam -o final_sorted_trimer.bam &&
-                   samtools index final_sorted_trimer.bam'''
-
-    P.run(statement)
-
-
-@transform(run_samtools_trimer,
            regex("final_sorted_trimer.bam"),
            r"final_XT_trimer.bam")
 def add_xt_tag_trimer(infile, outfile):
     '''Add trancript name to XT tag in bam file so umi-tools counts can be  perfromed'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -546,8 +501,6 @@ def add_xt_tag_trimer(infile, outfile):
 def run_greedy(infile, outfile):
     '''Run greedy algorithm to collapse the UMIs'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/greedy_sc.py count -i %(infile)s -t XT -o %(outfile)s'''
 
     P.run(statement)
@@ -559,11 +512,9 @@ def run_greedy(infile, outfile):
            r"mtx_greedy.dir/genes.mtx")
 def convert_tomtx_greedy(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_greedy.dir/'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 @follows(convert_tomtx_directional, convert_tomtx_collapsed, convert_tomtx, convert_tomtx_greedy)
@@ -91,6 +91,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 # Determine the location of the input fastq files
 
 try:
@@ -124,15 +131,14 @@ def split_fastq(infile, outfiles):
 
     infile = "".join(infile)
 
-    statement = '''zcat %(infile)s | split -l %(split)s - out. &&
-                   mv out*.* split_tmp.dir/'''
+    statement = '''igzip -cd %(infile)s | split -l %(split)s - split_tmp.dir/out.'''
 
     P.run(statement)
 
 
 @follows(mkdir("polyA_correct.dir"))
 @transform(split_fastq,
-           regex("split_tmp.dir/out.(\S+)"),
+           regex(r"split_tmp.dir/out.(\S+)"),
            r"polyA_correct.dir/\1_correct_polya.fastq")
 def correct_polyA(infile, outfile):
     '''
@@ -142,8 +148,6 @@ def correct_polyA(infile, outfile):
     split FASTQ file and generates a corrected FASTQ file.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/complement_polyA_singlecell.py --infile=%(infile)s --outname=%(outfile)s'''
 
     P.run(statement)
@@ -151,7 +155,7 @@ def correct_polyA(infile, outfile):
 
 @follows(mkdir("polyA_umi.dir"))
 @transform(correct_polyA,
-           regex("polyA_correct.dir/(\S+)_correct_polya.fastq"),
+           regex(r"polyA_correct.dir/(\S+)_correct_polya.fastq"),
            r"polyA_umi.dir/\1.fastq.gz")
 def identify_bcumi(infile, outfile):
     '''
@@ -166,8 +170,6 @@ def identify_bcumi(infile, outfile):
     barcode_len = PARAMS['barcode_len']
     cmimode = PARAMS['cmimode']
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/identify_bcumi_macosko.py --outfile=%(outfile)s --infile=%(infile)s --whitelist=polyA_umi.dir/%(name)s.whitelist.txt --barcode_len=%(barcode_len)s --cmimode=%(cmimode)s'''
 
     P.run(statement)
@@ -196,7 +198,7 @@ def merge_whitelist(infiles, outfile):
 @follows(merge_whitelist)
 @follows(mkdir("correct_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            r"correct_reads.dir/\1.fastq.gz")
 def correct_reads(infile, outfile):
     '''Correct the barcodes using majority vote'''
@@ -204,8 +206,6 @@ def correct_reads(infile, outfile):
     infile = infile
     cells = PARAMS['cells']
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
 
     statement = '''python %(PYTHON_ROOT)s/correct_10xbarcode.py --infile=%(infile)s --outfile=%(outfile)s --cells=%(cells)s --whitelist=whitelist.txt  --cmimode=0 --umi=8'''
 
@@ -256,11 +256,11 @@ def mapping(infile, outfile):
 def run_samtools(infile, outfile):
     '''convert sam to bam and sort -F 272'''
 
-    statement = '''samtools view -bS %(infile)s > final.bam &&
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o final.bam %(infile)s &&
                    samtools sort final.bam -o final_sorted.bam &&
                    samtools index final_sorted.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(run_samtools,
@@ -274,10 +274,7 @@ def add_xt_tag(infile, outfile):
     transcript information.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -304,11 +301,9 @@ def convert_tomtx(infile, outfile):
     '''
     This function takes an input BAM file with XT tags and generates a counts matrix file in the MTX format.
     '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx.dir/'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 @merge(identify_bcumi, "merge_uncorrected.fastq.gz")
@@ -346,15 +341,13 @@ def mapping_trimer(infile, outfile):
 
 @follows(mkdir("collapse_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            r"collapse_reads.dir/\1.fastq.gz")
 def collapse_reads(infile, outfile):
     '''Correct the barcodes by picking first ucleotide in the barcode and umi'''
 
     infile = infile
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     if PARAMS['trimer_beads']:
 
         statement = '''python %(PYTHON_ROOT)s/single_nucleotide_select.py --infile=%(infile)s --outfile=%(outfile)s'''
@@ -406,11 +399,11 @@ def mapping_collapsed(infile, outfile):
 def run_samtools_collapsed(infile, outfile):
     '''convert sam to bam and sort -F 272'''
 
-    statement = '''samtools view -bS %(infile)s > final_collapsed.bam &&
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o final_collapsed.bam %(infile)s &&
                    samtools sort final_collapsed.bam -o final_sorted_collapsed.bam &&
                    samtools index final_sorted_collapsed.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(run_samtools_collapsed,
@@ -419,10 +412,7 @@ def run_samtools_collapsed(infile, outfile):
 def add_xt_tag_collapsed(infile, outfile):
     '''Add trancript name to XT tag in bam file so umi-tools counts can be  perfromed'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -444,11 +434,9 @@ def count_collapsed(infile, outfile):
            r"mtx_collapsed.dir/genes.mtx")
 def convert_tomtx_collapsed(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_collapsed.dir/ --filter=3'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 
@@ -469,11 +457,9 @@ def count_collapsed_direction(infile, outfile):
            r"mtx_collapsed_directional.dir/genes.mtx")
 def convert_tomtx_directional(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_collapsed_directional.dir/ --filter=3'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 ###########################################################################
@@ -522,11 +508,11 @@ def run_minimap2_trimer(infile, outfile):
 def run_samtools_trimer(infile, outfile):
     '''convert sam to bam and sort -F 272'''
 
-    statement = '''samtools view -bS %(infile)s > final_trimer.bam &&
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o final_trimer.bam %(infile)s &&
                    samtools sort final_trimer.bam -o final_sorted_trimer.bam &&
                    samtools index final_sorted_trimer.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(run_samtools_trimer,
@@ -535,10 +521,7 @@ def run_samtools_trimer(infile, outfile):
 def add_xt_tag_trimer(infile, outfile):
     '''Add trancript name to XT tag in bam file so umi-tools counts can be  perfromed'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -550,8 +533,6 @@ def add_xt_tag_trimer(infile, outfile):
 def run_greedy(infile, outfile):
     '''Run greedy algorithm to collapse the UMIs'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/greedy_sc.py count -i %(infile)s -t XT -o %(outfile)s'''
 
     P.run(statement)
@@ -563,11 +544,9 @@ def run_greedy(infile, outfile):
            r"mtx_greedy.dir/genes.mtx")
 def convert_tomtx_greedy(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_greedy.dir/'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 @follows(convert_tomtx_directional, convert_tomtx_collapsed, convert_tomtx, convert_tomtx_greedy)
@@ -91,6 +91,13 @@ PARAMS = P.get_parameters(
      "pipeline.yml"])
 
 
+# Location of the helper scripts shipped with the package, exposed
+# through PARAMS so that every P.run statement can interpolate
+# %(PYTHON_ROOT)s without each task re-deriving the path
+PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python")
+PARAMS["PYTHON_ROOT"] = PYTHON_ROOT
+
+
 # Determine the location of the input fastq files
 
 try:
@@ -124,15 +131,14 @@ def split_fastq(infile, outfiles):
 
     infile = "".join(infile)
 
-    statement = '''zcat %(infile)s | split -l %(split)s - out. &&
-                   mv out*.* split_tmp.dir/'''
+    statement = '''igzip -cd %(infile)s | split -l %(split)s - split_tmp.dir/out.'''
 
     P.run(statement)
 
 
 @follows(mkdir("polyA_correct.dir"))
 @transform(split_fastq,
-           regex("split_tmp.dir/out.(\S+)"),
+           regex(r"split_tmp.dir/out.(\S+)"),
            r"polyA_correct.dir/\1_correct_polya.fastq")
 def correct_polyA(infile, outfile):
     '''
@@ -142,8 +148,6 @@ def correct_polyA(infile, outfile):
     split FASTQ file and generates a corrected FASTQ file.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/complement_polyA_scolor.py --infile=%(infile)s --outname=%(outfile)s'''
 
     P.run(statement)
@@ -151,7 +155,7 @@ def correct_polyA(infile, outfile):
 
 @follows(mkdir("polyA_umi.dir"))
 @transform(correct_polyA,
-           regex("polyA_correct.dir/(\S+)_correct_polya.fastq"),
+           regex(r"polyA_correct.dir/(\S+)_correct_polya.fastq"),
            r"polyA_umi.dir/\1.fastq.gz")
 def identify_bcumi(infile, outfile):
     '''
@@ -166,8 +170,6 @@ def identify_bcumi(infile, outfile):
     cmimode = PARAMS['cmimode']
     barcode = PARAMS['barcode_len']
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     if PARAMS['umi_positional']:
         statement = '''python %(PYTHON_ROOT)s/identify_bcumi_sccolorseqv2_position.py --outfile=%(outfile)s --infile=%(infile)s --whitelist=polyA_umi.dir/%(name)s.whitelist.txt --cmimode=%(cmimode)s '''
     else:
@@ -200,7 +202,7 @@ def merge_whitelist(infiles, outfile):
 @follows(merge_whitelist)
 @follows(mkdir("correct_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            add_inputs(merge_whitelist),
            r"correct_reads.dir/\1.fastq.gz")
 def correct_reads(infiles, outfile):
@@ -209,8 +211,6 @@ def correct_reads(infiles, outfile):
     infile, whitelist_file = infiles
     cells = PARAMS['cells']
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/correct_10xbarcode.py --infile=%(infile)s --outfile=%(outfile)s --cells=%(cells)s --whitelist=%(whitelist_file)s  --cmimode=0 --umi=16'''
 
     P.run(statement, job_options='-t 24:00:00')
@@ -260,11 +260,11 @@ def mapping(infile, outfile):
 def run_samtools(infile, outfile):
     '''convert sam to bam and sort -F 272'''
 
-    statement = '''samtools view -bS %(infile)s > final.bam &&
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o final.bam %(infile)s &&
                    samtools sort final.bam -o final_sorted.bam &&
                    samtools index final_sorted.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(run_samtools,
@@ -278,10 +278,7 @@ def add_xt_tag(infile, outfile):
     transcript information.
     '''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -308,11 +305,9 @@ def convert_tomtx(infile, outfile):
     '''
     This function takes an input BAM file with XT tags and generates a counts matrix file in the MTX format.
     '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx.dir/'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 @merge(identify_bcumi, "merge_uncorrected.fastq.gz")
@@ -350,15 +345,13 @@ def mapping_trimer(infile, outfile):
 
 @follows(mkdir("collapse_reads.dir"))
 @transform(identify_bcumi,
-           regex("polyA_umi.dir/(\S+).fastq.gz"),
+           regex(r"polyA_umi.dir/(\S+).fastq.gz"),
            r"collapse_reads.dir/\1.fastq.gz")
 def collapse_reads(infile, outfile):
     '''Correct the barcodes by picking first ucleotide in the barcode and umi'''
 
     infile = infile
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     if PARAMS['trimer_beads']:
 
         statement = '''python %(PYTHON_ROOT)s/single_nucleotide_select.py --infile=%(infile)s --outfile=%(outfile)s'''
@@ -410,11 +403,11 @@ def mapping_collapsed(infile, outfile):
 def run_samtools_collapsed(infile, outfile):
     '''convert sam to bam and sort -F 272'''
 
-    statement = '''samtools view -bS %(infile)s > final_collapsed.bam &&
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o final_collapsed.bam %(infile)s &&
                    samtools sort final_collapsed.bam -o final_sorted_collapsed.bam &&
                    samtools index final_sorted_collapsed.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(run_samtools_collapsed,
@@ -423,10 +416,7 @@ def run_samtools_collapsed(infile, outfile):
 def add_xt_tag_collapsed(infile, outfile):
     '''Add trancript name to XT tag in bam file so umi-tools counts can be  perfromed'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -448,11 +438,9 @@ def count_collapsed(infile, outfile):
            r"mtx_collapsed.dir/genes.mtx")
 def convert_tomtx_collapsed(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_collapsed.dir/ --filter=3'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 
@@ -473,11 +461,9 @@ def count_collapsed_direction(infile, outfile):
            r"mtx_collapsed_directional.dir/genes.mtx")
 def convert_tomtx_directional(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_collapsed_directional.dir/ --filter=3'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 ###########################################################################
@@ -526,11 +512,11 @@ def run_minimap2_trimer(infile, outfile):
 def run_samtools_trimer(infile, outfile):
     '''convert sam to bam and sort -F 272'''
 
-    statement = '''samtools view -bS %(infile)s > final_trimer.bam &&
+    statement = '''samtools view -b -@ %(job_threads)s --no-PG -o final_trimer.bam %(infile)s &&
                    samtools sort final_trimer.bam -o final_sorted_trimer.bam &&
                    samtools index final_sorted_trimer.bam'''
 
-    P.run(statement, job_options='-t 24:00:00')
+    P.run(statement, job_threads=4, job_options='-t 24:00:00')
 
 
 @transform(run_samtools_trimer,
@@ -539,10 +525,7 @@ def run_samtools_trimer(infile, outfile):
 def add_xt_tag_trimer(infile, outfile):
     '''Add trancript name to XT tag in bam file so umi-tools counts can be  perfromed'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
-    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s &&
-                   samtools index %(outfile)s'''
+    statement = '''python %(PYTHON_ROOT)s/xt_tag_nano.py --infile=%(infile)s --outfile=%(outfile)s'''
 
     P.run(statement)
 
@@ -554,8 +537,6 @@ def add_xt_tag_trimer(infile, outfile):
 def run_greedy(infile, outfile):
     '''Run greedy algorithm to collapse the UMIs'''
 
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/greedy_sc.py count -i %(infile)s -t XT -o %(outfile)s'''
 
     P.run(statement)
@@ -567,11 +548,9 @@ def run_greedy(infile, outfile):
            r"mtx_greedy.dir/genes.mtx")
 def convert_tomtx_greedy(infile, outfile):
     ''' '''
-    PYTHON_ROOT = os.path.join(os.path.dirname(__file__), "python/")
-
     statement = '''python %(PYTHON_ROOT)s/save_mtx.py --data=%(infile)s --dir=mtx_greedy.dir/'''
 
-    P.run(statement, job_memory="250G")
+    P.run(statement, job_memory="16G")
 
 
 @follows(convert_tomtx_directional, convert_tomtx_collapsed, convert_tomtx, convert_tomtx_greedy)
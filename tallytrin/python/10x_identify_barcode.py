@@ -1,5 +1,6 @@
 import sys
 import regex
+import multiprocessing
 import cgatcore.iotools as iotools
 import pysam
 import logging
@@ -33,6 +34,8 @@ parser.add_argument("--barcode", default='16', type=int,
                     help='Length of barcode required')
 parser.add_argument("--umi", default='12', type=int,
                     help='Length of umi required')
+parser.add_argument("--processes", default=4, type=int,
+                    help='number of worker processes for barcode identification')
 
 args = parser.parse_args()
 
@@ -48,55 +51,67 @@ log =  iotools.open_file(args.outfile  + ".log","w")
 # generate set of barcodes for whitelist
 barcodes = []
 
-outfile = open(args.outfile, "w")
+
+def process_record(record):
+    '''
+    Identify the barcode and UMI in a single (name, sequence, quality)
+    tuple. Returns a (fastq entry, barcode) pair, or (None, None) when
+    no barcode and UMI could be identified. The pairwise alignments are
+    the hot loop, so this function is mapped over a multiprocessing
+    pool in batches.
+    '''
+
+    name, seq, quality = record
+
+    aligns_a = Bio.pairwise2.align.localms(seq, "AGATCGGAAGAGCGT", 2, -1, -0.5, -0.1)
+    aligns_b = Bio.pairwise2.align.localms(seq, "AAAAAAAAA", 2, -1, -0.5, -0.1)
+
+    if not aligns_a or not aligns_b:
+        return None, None
+
+    al1_a, al2_a, score_a, begin_a, end_a = aligns_a[0]
+    al1_b, al2_b, score_b, begin_b, end_b = aligns_b[0]
+
+    length_umibarcode = len(seq[end_b:begin_a])
+
+    if length_umibarcode >= 20:
+        if args.cmimode == '1':
+            umi = seq[begin_a:end_a]
+            umi = umi[:15]
+        else:
+            umi_start = int(16 + args.umi)
+            umi = seq[begin_a-umi_start:begin_a-16]
+        barcode = seq[begin_a-16:begin_a][:int(args.barcode)]
+        seq_new = seq[:begin_b]
+        quality_new = quality[:begin_b]
+        return ("@%s\n%s\n+\n%s\n" % (name + "_" + barcode + "_" + umi, seq_new, quality_new),
+                barcode)
+
+    return None, None
+
+
+# BGZF output so downstream stages can decompress in parallel
+outfile = pysam.BGZFile(args.outfile, "wb")
 
 n = 0
 y = 0
 
-with pysam.FastxFile(args.infile) as fh:
-    
-    for record in fh:
-        n+=1
-
-        first = 0
-
-        seq = record.sequence
-
-        for a, b in zip(Bio.pairwise2.align.localms(seq,"AGATCGGAAGAGCGT", 2, -1, -0.5, -0.1), Bio.pairwise2.align.localms(seq,"AAAAAAAAA", 2, -1, -0.5, -0.1)):
-            first +=1
-            if first == 1:
-                al1_a, al2_a, score_a, begin_a, end_a = a 
-                al1_a, al2_b, score_b, begin_b, end_b = b 
-            else:
-                first = 0
-                break
-            length_umibarcode = len(record.sequence[end_b:begin_a])
-
-            if length_umibarcode >= 20:
-                y+=1
-                if args.cmimode == '1':
-                    umi = record.sequence[begin_a:end_a]
-                    umi = umi[:15]
-                else:
-                    umi_start = int(16 + args.umi)
-                    print(umi_start)
-                    umi = record.sequence[begin_a-umi_start:begin_a-16]
-                    print(umi)
-                if len(umi) == 15 and args.cmimode == '1':
-                    barcode = record.sequence[begin_a-16:begin_a][:int(args.barcode)]
-                    barcodes.append(barcode)
-                    seq_new = record.sequence[:begin_b]
-                    quality_new = record.quality[:begin_b]
-
-                    outfile.write("@%s\n%s\n+\n%s\n" % (record.name + "_" + barcode + "_" + umi, seq_new, quality_new))
-                else:
-                    barcode = record.sequence[begin_a-16:begin_a][:int(args.barcode)]
-                    barcodes.append(barcode)
-                    seq_new = record.sequence[:begin_b]
-                    quality_new = record.quality[:begin_b]
-
-                    outfile.write("@%s\n%s\n+\n%s\n" % (record.name + "_" + barcode + "_" + umi, seq_new, quality_new))
-                
+# These scripts run their driver code at module level, so the pool must
+# use the fork start method: spawn would re-import the script in every
+# worker and re-run argparse and the file handling. fork also hands the
+# workers the parsed args without pickling.
+with pysam.FastxFile(args.infile) as fh, \
+     multiprocessing.get_context("fork").Pool(args.processes) as pool:
+
+    records = ((record.name, record.sequence, record.quality) for record in fh)
+
+    for entry, barcode in pool.imap(process_record, records, chunksize=500):
+        n += 1
+        if entry is not None:
+            y += 1
+            barcodes.append(barcode)
+            outfile.write(entry.encode("ascii"))
+
 outfile.close()
 
                 
@@ -5,6 +5,11 @@ import pysam
 import logging
 import argparse
 
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
 
 
 # ########################################################################### #
@@ -41,7 +46,17 @@ def reverse_complement_table(seq):
     return seq.translate(tab)[::-1]
 
 
-outfile = iotools.open_file(args.outname, "w")
+def open_output(path):
+    '''Open gzipped output through ISA-L at compression level 1 when
+    python-isal is installed, which keeps compression off the critical
+    path of the parsing loop.'''
+
+    if path.endswith(".gz") and igzip is not None:
+        return igzip.open(path, "wt", compresslevel=1)
+    return iotools.open_file(path, "w")
+
+
+outfile = open_output(args.outname)
 log =  iotools.open_file(args.outname + ".log","w")
 n = 0
 y = 0
@@ -1,5 +1,6 @@
 import sys
 import regex
+import numpy as np
 import cgatcore.iotools as iotools
 import pysam
 import logging
@@ -42,7 +43,8 @@ print(args)
 # ########################################################################### #
 
 
-outf =  iotools.open_file(args.outfile,"w")
+# BGZF output so downstream stages can decompress in parallel
+outf = pysam.BGZFile(args.outfile, "wb")
 log =  iotools.open_file(args.outfile + ".log","w")
 barcodes = iotools.open_file(args.whitelist)
 
@@ -58,17 +60,57 @@ barcode_lists = []
 for key, count in lists:
     barcode_lists.append(key)
 
+# The whitelist is scanned once per read, so hold the fixed-length
+# barcodes as a contiguous uint8 matrix of their ASCII bytes: one
+# vectorised (matrix != query) comparison then gives every Hamming
+# distance at once. Barcodes of any other length (truncated reads)
+# stay in a python fallback list.
 
-def closest_match(input_string, string_list):
-    closest_match = None
-    min_distance = float('inf')
+whitelist_set = set(barcode_lists)
 
-    for candidate in string_list:
-        distance = sum(ch1 != ch2 for ch1, ch2 in zip(input_string, candidate))
-        if distance <= 2 and distance < min_distance:
-            closest_match = candidate
+if barcode_lists:
+    BARCODE_LEN = Counter(len(bc) for bc in barcode_lists).most_common(1)[0][0]
+else:
+    BARCODE_LEN = 0
+
+matrix_barcodes = [bc for bc in barcode_lists if len(bc) == BARCODE_LEN]
+other_barcodes = [bc for bc in barcode_lists if len(bc) != BARCODE_LEN]
+
+whitelist_matrix = np.frombuffer(
+    "".join(matrix_barcodes).encode("ascii"),
+    dtype=np.uint8).reshape(len(matrix_barcodes), BARCODE_LEN if BARCODE_LEN else 1)
+
+
+def hamming(input_string, candidate):
+    return sum(ch1 != ch2 for ch1, ch2 in zip(input_string, candidate))
+
+
+def closest_match(input_string):
+
+    if input_string in whitelist_set:
+        return input_string
+
+    best = None
+    min_distance = 3
+
+    if len(input_string) == BARCODE_LEN and len(matrix_barcodes):
+        query = np.frombuffer(input_string.encode("ascii"), dtype=np.uint8)
+        distances = (whitelist_matrix != query).sum(axis=1)
+        idx = int(np.argmin(distances))
+        if distances[idx] < min_distance:
+            best = matrix_barcodes[idx]
+            min_distance = int(distances[idx])
+        fallback = other_barcodes
+    else:
+        fallback = barcode_lists
+
+    for candidate in fallback:
+        distance = hamming(input_string, candidate)
+        if distance < min_distance:
+            best = candidate
             min_distance = distance
-    return closest_match
+
+    return best
 
 
 with pysam.FastxFile(args.infile) as fh:
@@ -80,7 +122,7 @@ with pysam.FastxFile(args.infile) as fh:
         barcode = record.name.split("_")[1]
         umi = record.name.split("_")[2]
 
-        match = closest_match(barcode, barcode_lists)
+        match = closest_match(barcode)
         
         if match:
             barcode = match
@@ -89,7 +131,7 @@ with pysam.FastxFile(args.infile) as fh:
 
         if len(umi) == int(args.umi):
 
-            outf.write("@%s\n%s\n+\n%s\n" % (name + "_" + barcode + "_" + umi, record.sequence, record.quality))
+            outf.write(("@%s\n%s\n+\n%s\n" % (name + "_" + barcode + "_" + umi, record.sequence, record.quality)).encode("ascii"))
             
 
 outf.close()
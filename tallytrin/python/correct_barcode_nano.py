@@ -34,7 +34,8 @@ print(args)
 # ########################################################################### #
 
 
-outf =  iotools.open_file(args.outfile,"w")
+# BGZF output so downstream stages can decompress in parallel
+outf = pysam.BGZFile(args.outfile, "wb")
 log =  iotools.open_file(args.outfile + ".log","w")
 
 
@@ -67,7 +68,7 @@ with pysam.FastxFile(args.infile) as fh:
         barcode_collapse = barcode_collapse[:27]
         umi_collapse = "".join(umi_collapse)
         
-        outf.write("@%s\n%s\n+\n%s\n" % (name + "_" + barcode_collapse + "_" + umi_collapse, record.sequence, record.quality))
+        outf.write(("@%s\n%s\n+\n%s\n" % (name + "_" + barcode_collapse + "_" + umi_collapse, record.sequence, record.quality)).encode("ascii"))
             
 
 outf.close()
@@ -0,0 +1,78 @@
+import sys
+import collections
+import cgatcore.iotools as iotools
+import pysam
+import logging
+import argparse
+
+
+# ########################################################################### #
+# ###################### Set up the logging ################################# #
+# ########################################################################### #
+
+logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+L = logging.getLogger("fast_unique_count.py")
+
+
+# ########################################################################### #
+# ######################## Parse the arguments ############################## #
+# ########################################################################### #
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--infile", default=None, type=str,
+                    help='bam file with XT gene tags and _barcode_umi read names')
+parser.add_argument("--outfile", default=None, type=str,
+                    help='name for the output counts table')
+
+args = parser.parse_args()
+
+L.info("args:")
+print(args)
+
+# ########################################################################### #
+# ######################## Code                ############################## #
+# ########################################################################### #
+
+# Single-pass equivalent of umi_tools count --method unique --per-gene
+# --gene-tag=XT --per-cell: collect the unique UMIs per (gene, cell) pair
+# in a hashmap, without the per-gene network construction umi_tools does.
+# The cell barcode and UMI are the last two _-separated fields of the
+# read name, as written by the barcode identification scripts.
+
+
+def open_outfile(path):
+
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.open(path, "wt")
+
+    return iotools.open_file(path, "w")
+
+
+umis = collections.defaultdict(set)
+
+n = 0
+counted = 0
+
+with pysam.AlignmentFile(args.infile, "rb", threads=4) as bam:
+
+    for read in bam:
+        n += 1
+
+        if read.is_unmapped or read.is_secondary or read.is_supplementary:
+            continue
+        if not read.has_tag("XT"):
+            continue
+
+        gene = read.get_tag("XT")
+        cell, umi = read.query_name.rsplit("_", 2)[-2:]
+        umis[(gene, cell)].add(umi)
+        counted += 1
+
+with open_outfile(args.outfile) as outfile:
+
+    outfile.write("gene\tcell\tcount\n")
+    for (gene, cell) in sorted(umis):
+        outfile.write("%s\t%s\t%i\n" % (gene, cell, len(umis[(gene, cell)])))
+
+L.info("processed %i alignments, counted %i" % (n, counted))
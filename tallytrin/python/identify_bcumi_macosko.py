@@ -61,7 +61,8 @@ def find_substring(long_string, subset_str):
         return None
 
 
-outfile = open(args.outfile, "w")
+# BGZF output so downstream stages can decompress in parallel
+outfile = pysam.BGZFile(args.outfile, "wb")
 
 n = 0
 y = 0
@@ -103,7 +104,7 @@ with pysam.FastxFile(args.infile) as fh:
                 seq_new = seq[:begin_b]
                 quality_new = record.quality[:begin_b]
                 y += 1
-                outfile.write("@%s\n%s\n+\n%s\n" % (record.name + "_" + barcode + "_" + umi, seq_new, quality_new))
+                outfile.write(("@%s\n%s\n+\n%s\n" % (record.name + "_" + barcode + "_" + umi, seq_new, quality_new)).encode("ascii"))
             else:
                 pass
                 
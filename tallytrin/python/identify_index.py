@@ -120,11 +120,66 @@ def reverse_complement(seq):
     return seq.translate(tab)[::-1]
 
 
+def orient_read(record):
+    '''Return (sequence, quality) with the polyA on the expected strand,
+    or None if the read is too short or carries no polyA tract. This
+    replaces the separate complement_polyA pass over the split files.'''
+
+    if len(record.sequence) < 300:
+        return None
+
+    seq = record.sequence[:300]
+    m = regex.findall("(TTTTTTTTTTTTTTT){e<=0}", str(seq))
+    if m:
+        return reverse_complement(str(record.sequence)), str(record.quality)[::-1]
+
+    seq = record.sequence[:-200:]
+    m = regex.findall("(AAAAAAAAAAAAAAA){e<=0}", str(seq))
+    if m:
+        return str(record.sequence), str(record.quality)
+
+    return None
+
+
+# Buffer the output per sample and write through a cached handle so the
+# inner loop does not open, append and close a file for every record.
+
+FLUSH_BYTES = 65536
+
+buffers = collections.defaultdict(list)
+buffer_bytes = collections.defaultdict(int)
+handles = {}
+
+
+def flush_buffer(fname):
+
+    handle = handles.get(fname)
+    if handle is None:
+        handle = open('seperate_samples.dir/' + fname, "w")
+        handles[fname] = handle
+    handle.writelines(buffers[fname])
+    buffers[fname].clear()
+    buffer_bytes[fname] = 0
+
+
+def write_record(fname, name, sequence, quality):
+
+    entry = "@%s\n%s\n+\n%s\n" % (name, sequence, quality)
+    buffers[fname].append(entry)
+    buffer_bytes[fname] += len(entry)
+    if buffer_bytes[fname] >= FLUSH_BYTES:
+        flush_buffer(fname)
+
+
 with pysam.FastxFile(args.infile) as fh:
     
     for record in fh:
         
-        seq_nano = record.sequence
+        oriented = orient_read(record)
+        if oriented is None:
+            continue
+
+        seq_nano, quality_nano = oriented
         primer = "(%s){e<=0}" % (args.primer)
 
         m=regex.finditer(str(primer), str(seq_nano[:150]))
@@ -164,13 +219,7 @@ with pysam.FastxFile(args.infile) as fh:
             if fname == name + '' + 'Unidentified.fastq':
                 pass
 
-            if os.path.exists('seperate_samples.dir/' + fname):
-                
-                with open('seperate_samples.dir/'+ fname, "a") as myfile:
-                    myfile.write("@%s\n%s\n+\n%s\n" % (record.name, record.sequence, record.quality))
-            else:
-                with iotools.open_file('seperate_samples.dir/' + fname, "w") as myfile:
-                    myfile.write("@%s\n%s\n+\n%s\n" % (record.name, record.sequence, record.quality))
+            write_record(fname, record.name, seq_nano, quality_nano)
 
         primer2 = "(%s){e<=0}" % (reverse_complement(args.primer))
 
@@ -206,13 +255,11 @@ with pysam.FastxFile(args.infile) as fh:
             else:
                 fname = name + '' + "Unidentified.fastq"
 
-            if os.path.exists('seperate_samples.dir/' + fname):
-                
-                with open('seperate_samples.dir/'+ fname, "a") as myfile:
-                    myfile.write("@%s\n%s\n+\n%s\n" % (record.name, record.sequence, record.quality))
-            else:
-                with iotools.open_file('seperate_samples.dir/' + fname, "w") as myfile:
-                    myfile.write("@%s\n%s\n+\n%s\n" % (record.name, record.sequence, record.quality))
-
+            write_record(fname, record.name, seq_nano, quality_nano)
 
+for fname in list(buffers):
+    if buffers[fname]:
+        flush_buffer(fname)
 
+for handle in handles.values():
+    handle.close()
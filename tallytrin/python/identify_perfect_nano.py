@@ -1,6 +1,7 @@
 import sys
 import re
 import regex
+import multiprocessing
 import cgatcore.iotools as iotools
 import pysam
 import logging
@@ -28,6 +29,8 @@ parser.add_argument("--infile", default=None, type=str,
                     help='nanopore infile fastq  file')
 parser.add_argument("--outfile", default=None, type=str,
                     help='name for output fastq files')
+parser.add_argument("--processes", default=4, type=int,
+                    help='number of worker processes for barcode identification')
 
 args = parser.parse_args()
 
@@ -59,46 +62,66 @@ def find_substring(long_string, subset_str):
 def most_common(lst):
     return max(set(lst), key=lst.count)
 
-outfile = open(args.outfile, "w")
+
+def process_record(record):
+    '''
+    Identify the barcode and UMI in a single (name, sequence, quality)
+    tuple. Returns a (fastq entry, barcode) pair, or (None, None) when
+    no barcode and UMI could be identified. The pairwise alignments are
+    the hot loop, so this function is mapped over a multiprocessing
+    pool in batches.
+    '''
+
+    name, seq, quality = record
+
+    aligns_a = Bio.pairwise2.align.localms(seq, "GTACTCTGCG", 2, -1, -1, -1)
+    aligns_b = Bio.pairwise2.align.localms(seq, "AAAAAAAAA", 2, -1, -1, -1)
+
+    if not aligns_a or not aligns_b:
+        return None, None
+
+    al1_a, al2_a, score_a, begin_a, end_a = aligns_a[0]
+    al1_b, al2_b, score_b, begin_b, end_b = aligns_b[0]
+
+    length_umibarcode = len(seq[end_b:begin_a])
+
+    if length_umibarcode > 48:
+
+        bc_start = find_substring(seq, "GTACTCTGCG")
+        if bc_start is not None:
+            barcode = seq[bc_start-30:bc_start]
+            umi = seq[bc_start-48:bc_start-30]
+        else:
+            return None, None
+        seq_new = seq[:begin_b]
+        quality_new = quality[:begin_b]
+        return ("@%s\n%s\n+\n%s\n" % (name + "_" + barcode + "_" + umi, seq_new, quality_new),
+                barcode)
+
+    return None, None
+
+
+# BGZF output so downstream stages can decompress in parallel
+outfile = pysam.BGZFile(args.outfile, "wb")
 
 n = 0
 y = 0
-with pysam.FastxFile(args.infile) as fh:
-    
-    for record in fh:
+# These scripts run their driver code at module level, so the pool must
+# use the fork start method: spawn would re-import the script in every
+# worker and re-run argparse and the file handling. fork also hands the
+# workers the parsed args without pickling.
+with pysam.FastxFile(args.infile) as fh, \
+     multiprocessing.get_context("fork").Pool(args.processes) as pool:
+
+    records = ((record.name, record.sequence, record.quality) for record in fh)
+
+    for entry, barcode in pool.imap(process_record, records, chunksize=500):
         n += 1
+        if entry is not None:
+            y += 1
+            barcodes.append(barcode)
+            outfile.write(entry.encode("ascii"))
 
-        seq = record.sequence
-        first = 0
-        for a, b in zip(Bio.pairwise2.align.localms(seq,"GTACTCTGCG", 2, -1, -1, -1), Bio.pairwise2.align.localms(seq,"AAAAAAAAA", 2, -1, -1, -1)):
-            first +=1
-            if first == 1:
-                al1_a, al2_a, score_a, begin_a, end_a = a 
-                al1_a, al2_b, score_b, begin_b, end_b = b 
-            else:
-                first = 0
-                break
-            length_umibarcode = len(seq[end_b:begin_a])
-
-            if length_umibarcode > 48:
-                
-                bc_start = find_substring(seq, "GTACTCTGCG")
-                if bc_start is not None:
-                    barcode = seq[bc_start-30:bc_start]
-                    print(barcode)
-                    barcodes.append(barcode)
-                    umi = seq[bc_start-48:bc_start-30]
-                    if umi is None:
-                        break
-                else:
-                    break
-                seq_new = seq[:begin_b]
-                quality_new = record.quality[:begin_b]
-                y += 1
-                outfile.write("@%s\n%s\n+\n%s\n" % (record.name + "_" + barcode + "_" + umi, seq_new, quality_new))
-            else:
-                pass
-                
 outfile.close()
 
                 
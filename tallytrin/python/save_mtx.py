@@ -1,9 +1,7 @@
 import sys
-import regex
-import cgatcore.iotools as iotools
-import pysam
 import logging
 import argparse
+import numpy as np
 import pandas as pd
 import scipy.sparse as sparse
 import scipy.io as io
@@ -29,6 +27,8 @@ parser.add_argument("--dir", default=None, type=str,
                     help='dir for output mtx')
 parser.add_argument("--filter", default=2, type=int,
                     help='filter threshold for counts')
+parser.add_argument("--chunksize", default=1000000, type=int,
+                    help='number of rows to read per chunk')
 
 args = parser.parse_args()
 
@@ -38,58 +38,81 @@ print(args)
 # ########################################################################### #
 # ######################## Code                ############################## #
 # ########################################################################### #
-def save_mtx(data, destination, cell_names=None, gene_names=None):
-    """Save a mtx file - taken from https://www.programcreek.com/python/?code=KrishnaswamyLab%2Fscprep%2Fscprep-master%2Fscprep%2Fio%2Fmtx.py
-    
+
+
+def read_chunks(data, filter_threshold, chunksize):
+    """Iterate over the counts table in chunks, dropping filtered rows."""
+
+    for chunk in pd.read_table(data, sep="\t", header=0, chunksize=chunksize):
+        chunk = chunk[chunk['count'] >= filter_threshold]
+        if len(chunk):
+            yield chunk
+
+
+def save_mtx(data, destination, cell_names, gene_names):
+    """Save a sparse counts matrix in mtx format.
+
     Parameters
     ----------
-    data : array-like, shape=[n_samples, n_features]
-        Input data, saved to destination/matrix.mtx
+    data : scipy.sparse matrix, shape=[n_samples, n_features]
+        Input data, saved to destination/genes.mtx
     destination : str
         Directory in which to save the data
-    cell_names : list-like, shape=[n_samples], optional (default: None)
-        Cell names associated with rows, saved to destination/cell_names.tsv.
-        If `data` is a pandas DataFrame and `cell_names` is None,
-        these are autopopulated from `data.index`.
-    gene_names : list-like, shape=[n_features], optional (default: None)
-        Cell names associated with rows, saved to destination/gene_names.tsv.
-        If `data` is a pandas DataFrame and `gene_names` is None,
-        these are autopopulated from `data.columns`.
-
-    Examples
-    --------
-    >>> import scprep
-    >>> scprep.io.save_mtx(data, destination="my_data")
-    >>> reload = scprep.io.load_mtx("my_data/matrix.mtx",
-    ...                             cell_names="my_data/cell_names.tsv",
-    ...                             gene_names="my_data/gene_names.tsv")
+    cell_names : list-like, shape=[n_samples]
+        Cell names associated with rows, saved to destination/genes.barcodes.txt
+    gene_names : list-like, shape=[n_features]
+        Gene names associated with columns, saved to destination/genes.genes.txt
     """
-    if isinstance(data, pd.DataFrame):
-        if cell_names is None:
-            cell_names = data.index
-        if gene_names is None:
-            gene_names = data.columns
-    data = sparse.coo_matrix(data)
+
     # handle ~/ and relative paths
-    #print(cell_names)
     destination = os.path.expanduser(destination)
     if not os.path.isdir(destination):
         os.mkdir(destination)
-    if cell_names is not None:
-        with open(os.path.join(destination, "genes.barcodes.txt"), "w") as handle:
-            for name in cell_names:
-                handle.write("{}\n".format(name))
-    if gene_names is not None:
-        with open(os.path.join(destination, "genes.genes.txt"), "w") as handle:
-            for name in gene_names:
-                handle.write("{}\n".format(name))
-    io.mmwrite(os.path.join(destination, "genes.mtx"), data) 
+    with open(os.path.join(destination, "genes.barcodes.txt"), "w") as handle:
+        for name in cell_names:
+            handle.write("{}\n".format(name))
+    with open(os.path.join(destination, "genes.genes.txt"), "w") as handle:
+        for name in gene_names:
+            handle.write("{}\n".format(name))
+    io.mmwrite(os.path.join(destination, "genes.mtx"), data)
+
+
+# First pass: assign an integer id to every cell and gene and count the
+# entries that survive the filter, so the triplet arrays can be
+# pre-allocated. This keeps memory at O(non-zero entries) rather than the
+# O(cells x genes) dense frame a pivot would build.
+
+cell_ids = {}
+gene_ids = {}
+nnz = 0
+
+for chunk in read_chunks(args.data, args.filter, args.chunksize):
+    for name in chunk['cell'].unique():
+        if name not in cell_ids:
+            cell_ids[name] = len(cell_ids)
+    for name in chunk['gene'].unique():
+        if name not in gene_ids:
+            gene_ids[name] = len(gene_ids)
+    nnz += len(chunk)
+
+L.info("found %i cells, %i genes, %i entries" %
+       (len(cell_ids), len(gene_ids), nnz))
+
+# Second pass: fill the pre-allocated COO triplet arrays
 
+row = np.empty(nnz, dtype=np.int32)
+col = np.empty(nnz, dtype=np.int32)
+counts = np.empty(nnz, dtype=np.int32)
+pos = 0
 
-infile = pd.read_table(args.data, sep="\t", header=0)
-infile = infile[infile['count'] >= args.filter]
+for chunk in read_chunks(args.data, args.filter, args.chunksize):
+    n = len(chunk)
+    row[pos:pos + n] = chunk['cell'].map(cell_ids).to_numpy(dtype=np.int32)
+    col[pos:pos + n] = chunk['gene'].map(gene_ids).to_numpy(dtype=np.int32)
+    counts[pos:pos + n] = chunk['count'].to_numpy(dtype=np.int32)
+    pos += n
 
-infile = infile.pivot(index='cell', columns='gene', values='count')
-infile.fillna(0, inplace=True)
+matrix = sparse.coo_matrix((counts, (row, col)),
+                           shape=(len(cell_ids), len(gene_ids)))
 
-save_mtx(infile, args.dir)
+save_mtx(matrix, args.dir, list(cell_ids), list(gene_ids))
@@ -0,0 +1,68 @@
+import sys
+import string
+import itertools
+import logging
+import argparse
+
+try:
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+
+# ########################################################################### #
+# ###################### Set up the logging ################################# #
+# ########################################################################### #
+
+logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+L = logging.getLogger("split_fastq.py")
+
+# ########################################################################### #
+# ######################## Parse the arguments ############################## #
+# ########################################################################### #
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--infile", default=None, type=str,
+                    help='infile fastq.gz file')
+parser.add_argument("--prefix", default=None, type=str,
+                    help='prefix for the output split files')
+parser.add_argument("--lines", default=None, type=int,
+                    help='number of lines per split file, must be a multiple of 4')
+
+args = parser.parse_args()
+
+L.info("args:")
+print(args)
+
+
+# ########################################################################### #
+# ######################## Code                ############################## #
+# ########################################################################### #
+
+# Stream the gzipped fastq through ISA-L igzip when available (falls back to
+# the stdlib gzip module) and write the splits directly to their final
+# location, so no zcat/split/mv subprocess pipeline is needed.
+
+BUFFER_SIZE = 1024 * 1024
+
+suffixes = ("".join(x) for x in
+            itertools.product(string.ascii_lowercase, repeat=2))
+
+outfile = None
+n = 0
+
+with gzip.open(args.infile, "rb") as fh:
+
+    for line in fh:
+        if n % args.lines == 0:
+            if outfile is not None:
+                outfile.close()
+            outfile = open(args.prefix + next(suffixes), "wb",
+                           buffering=BUFFER_SIZE)
+        outfile.write(line)
+        n += 1
+
+if outfile is not None:
+    outfile.close()
+
+L.info("wrote %s lines" % (n))
@@ -33,8 +33,8 @@ print(args)
 # ######################## Code                ############################## #
 # ########################################################################### #
 
-samfile = pysam.AlignmentFile(args.infile, "rb")
-outfile = pysam.AlignmentFile(args.outfile, "wb", template=samfile)
+samfile = pysam.AlignmentFile(args.infile, "rb", threads=4)
+outfile = pysam.AlignmentFile(args.outfile, "wb", template=samfile, threads=4)
 
 for read in samfile:
 
@@ -48,3 +48,5 @@ for read in samfile:
 
 samfile.close()
 outfile.close()
+
+pysam.index("-@", "4", args.outfile)